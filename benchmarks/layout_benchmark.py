@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Times the random rectangles layout of SlidingPanels (make_rectangles)
+# against the former sort on every split, and measures how much of the
+# images is cropped away when the prefetch buffer hands them out in
+# playlist order or matched to the aspect ratio of the panels.
+#
+#   python benchmarks/layout_benchmark.py [--rectangles 5,50,200,500,1000]
+#       [--repeat N] [--depth N] [--images N]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_PATH, 'stubs'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_PATH))
+
+import screensaver  # noqa: E402
+
+SCREEN = (1280, 720)
+# (width, height) of the images and how often they come
+IMAGE_SIZES = (((6000, 4000), 5), ((4000, 6000), 3), ((1920, 1080), 2), ((3000, 4000), 1), ((4000, 1000), 1))
+
+
+def make_rects_sorted(w, h, number):
+    # The layout as it used to be: sort everything for every split
+    rectangles = [ screensaver.LayoutRectangle(0, 0, w, h) ]
+    while ( len(rectangles) < number ):
+        rectangles.sort(key=lambda x: x.area, reverse=True)
+        rectangle = rectangles[0]
+        rectangles = rectangles + list(rectangle.random_divide())
+        rectangles.remove(rectangle)
+    return rectangles
+
+
+def time_layout(function, number, repeat):
+    random.seed(number)
+    start = time.time()
+    for i in range(repeat):
+        function(SCREEN[0], SCREEN[1], number)
+    return (time.time() - start) / repeat
+
+
+def cropped(image_size, slot):
+    # Share of the image cut off when it fills the slot (aspectRatio=1)
+    image_ratio = float(image_size[0]) / image_size[1]
+    slot_ratio = float(slot.w) / max(1, slot.h)
+    return 1.0 - min(image_ratio / slot_ratio, slot_ratio / image_ratio)
+
+
+def measure_crop(rectangles, depth, images, match):
+    # Feeds a stream of images through a prefetch buffer of depth and
+    # fills the panels round robin like the slideshow does
+    random.seed(len(rectangles))
+    sizes = [ size for size, weight in IMAGE_SIZES for i in range(weight) ]
+    buffer = screensaver.PrefetchBuffer(depth)
+    loss = 0.0
+    for i in range(images):
+        while ( len(buffer) < depth ):
+            size = random.choice(sizes)
+            buffer.put('image', None, None, size)
+        slot = rectangles[i % len(rectangles)]
+        aspect_ratio = float(slot.w) / max(1, slot.h) if match else None
+        image_url, control, size, caption = buffer.take(screensaver.PREFETCH_RESERVE, aspect_ratio)
+        loss += cropped(size, slot)
+    return loss / images, buffer.matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the panel layout and measure the cropping')
+    parser.add_argument('--rectangles', default='5,50,200,500,1000')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=10, help='prefetch buffer depth')
+    parser.add_argument('--images', type=int, default=5000)
+    args = parser.parse_args()
+
+    print('%10s %12s %12s %8s %12s %12s %9s' % (
+        'rectangles', 'sorted ms', 'heap ms', 'speedup', 'crop fifo', 'crop match', 'matched'
+    ))
+    for number in [ int(n) for n in args.rectangles.split(',') ]:
+        sorted_time = time_layout(make_rects_sorted, number, args.repeat)
+        heap_time = time_layout(screensaver.make_rectangles, number, args.repeat)
+        random.seed(number)
+        rectangles = screensaver.make_rectangles(SCREEN[0], SCREEN[1], number)
+        fifo_loss = measure_crop(rectangles, args.depth, args.images, False)[0]
+        match_loss, matches = measure_crop(rectangles, args.depth, args.images, True)
+        print('%10d %12.3f %12.3f %7.1fx %11.1f%% %11.1f%% %8.1f%%' % (
+            number, sorted_time * 1000, heap_time * 1000, sorted_time / heap_time,
+            fifo_loss * 100, match_loss * 100, 100.0 * matches / args.images
+        ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Compares the header-only metadata parser (read_image_header) with the
+# PIL based one (read_image_metadata) on a corpus of images.
+#
+#   python benchmarks/metadata_benchmark.py [corpus_dir] [--repeat N]
+#
+# Without corpus_dir a synthetic corpus of JPEG (with Exif), PNG and BMP
+# files is generated in a temporary directory.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_PATH, 'stubs'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_PATH))
+
+from PIL import Image  # noqa: E402
+
+import screensaver  # noqa: E402
+
+SIZES = ((6000, 4000), (4000, 6000), (1920, 1080), (800, 600))
+
+
+def make_corpus(directory, count):
+    random.seed(count)
+    for i in range(count):
+        width, height = random.choice(SIZES)
+        image = Image.new('RGB', (width, height), (i % 256, 80, 160))
+        kind = i % 4
+        if kind < 2:
+            exif = Image.Exif()
+            exif[screensaver.EXIF_ORIENTATION] = random.choice((1, 3, 6, 8))
+            exif[screensaver.EXIF_IFD_POINTER] = {
+                screensaver.EXIF_DATETIMEORIGINAL: '2013:09:%02d 12:00:00' % (i % 28 + 1)
+            }
+            # A profile in front of the frame header like many cameras write
+            image.save(
+                os.path.join(directory, 'image_%04d.jpg' % i),
+                exif=exif.tobytes(), icc_profile=b'\x00' * 3000, quality=80
+            )
+        elif kind == 2:
+            image.resize((width // 4, height // 4)).save(os.path.join(directory, 'image_%04d.png' % i))
+        else:
+            image.resize((width // 4, height // 4)).save(os.path.join(directory, 'image_%04d.bmp' % i))
+
+
+def measure(function, files, repeat):
+    results = {}
+    start = time.time()
+    for i in range(repeat):
+        for image_file in files:
+            results[image_file] = function(image_file)
+    return time.time() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the header parser with PIL')
+    parser.add_argument('corpus', nargs='?')
+    parser.add_argument('--count', type=int, default=40, help='size of the synthetic corpus')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = args.corpus
+    if not corpus:
+        corpus = tempfile.mkdtemp(prefix='metadata_corpus_')
+        make_corpus(corpus, args.count)
+    files = sorted(
+        os.path.join(corpus, f) for f in os.listdir(corpus)
+        if screensaver.is_image(f)
+    )
+    if not files:
+        sys.exit('no images found in %s' % corpus)
+
+    pil_time, pil_results = measure(screensaver.read_image_metadata, files, args.repeat)
+    header_time, header_results = measure(screensaver.read_image_header, files, args.repeat)
+
+    calls = len(files) * args.repeat
+    print('files:             %d (%d reads each)' % (len(files), args.repeat))
+    print('PIL:               %8.1f us/file' % (pil_time / calls * 1e6))
+    print('header parser:     %8.1f us/file' % (header_time / calls * 1e6))
+    print('speedup:           %8.1fx' % (pil_time / header_time))
+
+    mismatches = [ f for f in files if pil_results[f] != header_results[f] ]
+    for image_file in mismatches:
+        print('mismatch %s: PIL %r, header %r' % (image_file, pil_results[image_file], header_results[image_file]))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Compares the memory and speed of the compact Playlist with a plain list
+# of path strings iterated through cycle(), the way the playlist used to
+# be stored.
+#
+#   python benchmarks/playlist_benchmark.py [--images N] [--per-directory N]
+#
+# The paths are synthetic network paths, --per-directory images share a
+# directory. Memory is measured with tracemalloc and includes the strings.
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_PATH, 'stubs'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_PATH))
+
+import screensaver  # noqa: E402
+
+
+def iter_batches(count, per_directory):
+    # Batches of paths like the folder scanner yields them
+    for start in range(0, count, per_directory):
+        directory = 'smb://nas/photos/%04d/%02d/Holiday in Somewhere %05d/' % (
+            2000 + start // 50000, start // 5000 % 12 + 1, start // per_directory
+        )
+        yield [
+            directory + 'IMG_%08d.JPG' % i
+            for i in range(start, min(count, start + per_directory))
+        ]
+
+
+def run(build, count, per_directory):
+    start = time.time()
+    playlist, take = build(iter_batches(count, per_directory))
+    build_time = time.time() - start
+    start = time.time()
+    for i in range(count):
+        take()
+    # The second round is served from the saved copy of cycle()
+    for i in range(count):
+        take()
+    return playlist, build_time, time.time() - start
+
+
+def measure(build, count, per_directory):
+    # Timed without tracemalloc, which slows down every allocation
+    playlist, build_time, next_time = run(build, count, per_directory)
+    del playlist
+    tracemalloc.start()
+    playlist = run(build, count, per_directory)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, peak, build_time, next_time
+
+
+def build_list(batches):
+    images = []
+    for batch in batches:
+        images.extend(batch)
+    images_cycle = screensaver.cycle(images)
+    return images, lambda: next(images_cycle)
+
+
+def build_playlist(batches):
+    playlist = screensaver.Playlist(random_order=True)
+    for batch in batches:
+        playlist.extend(batch)
+    playlist.finish()
+    return playlist, playlist.next
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the compact playlist with list and cycle')
+    parser.add_argument('--images', type=int, default=500000)
+    parser.add_argument('--per-directory', type=int, default=200)
+    args = parser.parse_args()
+
+    print('%d images, %d per directory' % (args.images, args.per_directory))
+    print('%-16s %12s %12s %10s %12s %10s' % ('storage', 'memory MB', 'peak MB', 'bytes/img', 'build s', 'next us'))
+    for name, build in (('list + cycle', build_list), ('Playlist', build_playlist)):
+        current, peak, build_time, next_time = measure(build, args.images, args.per_directory)
+        print('%-16s %12.1f %12.1f %10.1f %12.2f %10.2f' % (
+            name, current / 1048576.0, peak / 1048576.0, float(current) / args.images,
+            build_time, next_time / (2 * args.images) * 1e6
+        ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
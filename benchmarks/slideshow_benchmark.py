@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Runs the slideshow modes headless against the stand-in Kodi modules in
+# benchmarks/stubs and reports images per second, time to first image,
+# image discovery time, the jitter of the image changes, peak memory and
+# the control operations.
+#
+#   python benchmarks/slideshow_benchmark.py [--modes TableDrop,GridSwitch]
+#       [--source image_folder|movies|albums|shows] [--images N]
+#       [--duration SECONDS] [--set setting=value ...] [--json FILE]
+#
+# Every mode runs in its own process with an empty profile (unless
+# --profile is given), so caches start cold and the peak memory is the
+# one of that mode only. Without --corpus a synthetic image tree is
+# generated, the JSON-RPC sources are served by a fake library made of
+# the same images. BENCHMARK_CONTROL_LATENCY and BENCHMARK_JSONRPC_LATENCY
+# (milliseconds) emulate the cost of the calls into Kodi.
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_PATH, 'stubs'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_PATH))
+
+from PIL import Image  # noqa: E402
+
+# Result key of the fake library per source
+LIBRARY_METHODS = {
+    'VideoLibrary.GetMovies': 'movies',
+    'VideoLibrary.GetTVShows': 'tvshows',
+    'AudioLibrary.GetAlbums': 'albums',
+    'AudioLibrary.GetArtists': 'artists',
+}
+SIZES = ((1920, 1080), (1280, 720), (1080, 1920), (4000, 3000))
+
+
+def make_tree(directory, count, per_directory=25):
+    # count images in a two level tree, every tenth one is big and rotated
+    random.seed(count)
+    for i in range(count):
+        sub_directory = os.path.join(
+            directory, 'folder_%02d' % (i // (per_directory * 4)), 'album_%03d' % (i // per_directory)
+        )
+        if not os.path.isdir(sub_directory):
+            os.makedirs(sub_directory)
+        width, height = SIZES[3] if i % 10 == 0 else random.choice(SIZES[:3])
+        image = Image.new('RGB', (width, height), (i % 256, 120, 200))
+        exif = Image.Exif()
+        exif[0x0112] = 6 if i % 10 == 0 else 1
+        image.save(os.path.join(sub_directory, 'image_%05d.jpg' % i), exif=exif.tobytes(), quality=70)
+
+
+def fill_library(corpus, size):
+    import xbmc
+    files = sorted(
+        os.path.join(root, f) for root, dirs, files in os.walk(corpus) for f in files
+    )
+    items = [
+        {'label': 'Item %d' % i, 'fanart': files[i % len(files)], 'thumbnail': files[-1 - i % len(files)]}
+        for i in range(size)
+    ]
+    for method, key in LIBRARY_METHODS.items():
+        xbmc.LIBRARY[method] = (key, items)
+
+
+def run_mode(mode, args):
+    # Runs one mode in this process and returns its results
+    import xbmcaddon
+    import xbmcgui
+
+    settings = {
+        'image_path': args.corpus + os.sep,
+        'image_path2': '',
+        'image_path3': '',
+        'metrics': 'false',
+    }
+    settings.update(dict(setting.split('=', 1) for setting in args.set))
+    xbmcaddon.SETTINGS.update(settings)
+    fill_library(args.corpus, args.library)
+
+    import screensaver
+    xbmcaddon.SETTINGS['mode'] = str(screensaver.MODES.index(mode))
+    xbmcaddon.SETTINGS['source'] = str(screensaver.SOURCES.index(args.source))
+    xbmcgui.reset_operations()
+
+    start = time.time()
+    instance = screensaver.ScreensaverManager()
+    screensaver.screensaver = instance
+    stop_time = []
+
+    def stop():
+        stop_time.append(time.time())
+        instance.stop()
+
+    timer = threading.Timer(args.duration, stop)
+    timer.start()
+    instance.start_loop()
+    loop_end = time.time()
+    timer.cancel()
+    if not stop_time:
+        stop_time.append(loop_end)
+    instance.close()
+
+    snapshot = instance.metrics.snapshot()
+    stages = snapshot['stages']
+    return {
+        'mode': mode,
+        'source': args.source,
+        'images_found': snapshot['gauges']['images_found'],
+        'images_shown': instance.image_count,
+        'images_per_second': round(instance.image_count / (stop_time[0] - start), 3),
+        'first_image_ms': stages.get('first_image', {}).get('max_ms'),
+        'discovery_ms': stages.get('discovery', {}).get('max_ms'),
+        'listing': stages.get('listing'),
+        'exit_ms': round((loop_end - stop_time[0]) * 1000, 1),
+        'jitter_p90_ms': stages.get('cadence_jitter', {}).get('p90_ms'),
+        'cadence': snapshot['gauges']['cadence'],
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'stages': stages,
+        'counters': snapshot['counters'],
+        'control_operations': dict(
+            (name, {'count': count, 'ms': round(seconds * 1000, 2)})
+            for name, (count, seconds) in sorted(xbmcgui.OPERATIONS.items())
+        ),
+    }
+
+
+def run_child(mode, args, profile):
+    # Runs run_mode in a fresh interpreter, the result is the last line
+    command = [sys.executable, os.path.abspath(__file__), '--child', mode] + args.child_args
+    environment = dict(os.environ, BENCHMARK_PROFILE=profile)
+    output = subprocess.check_output(command, env=environment)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def print_report(results):
+    print('%-14s %7s %7s %8s %10s %10s %10s %9s %8s %9s %8s' % (
+        'mode', 'found', 'shown', 'img/s', 'first ms', 'discov ms', 'jitter ms', 'overruns', 'exit ms',
+        'peak MB', 'ctl ops'
+    ))
+    for result in results:
+        print('%-14s %7d %7d %8.2f %10s %10s %10s %9d %8.1f %9.1f %8d' % (
+            result['mode'], result['images_found'], result['images_shown'], result['images_per_second'],
+            result['first_image_ms'], result['discovery_ms'], result['jitter_p90_ms'],
+            result['cadence']['overruns'], result['exit_ms'],
+            result['peak_rss_kb'] / 1024.0,
+            sum(operation['count'] for operation in result['control_operations'].values())
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the slideshow modes headless')
+    parser.add_argument('--modes', help='comma separated modes, default all but Random')
+    parser.add_argument('--source', default='image_folder', choices=('image_folder', 'movies', 'albums', 'shows'))
+    parser.add_argument('--corpus', help='image tree to use instead of a synthetic one')
+    parser.add_argument('--images', type=int, default=200, help='size of the synthetic tree')
+    parser.add_argument('--library', type=int, default=500, help='items of the fake JSON-RPC library')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per mode')
+    parser.add_argument('--set', action='append', default=[], metavar='SETTING=VALUE')
+    parser.add_argument('--profile', help='addon profile shared by all runs (warm caches)')
+    parser.add_argument('--json', help='write all results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args.child, args)))
+        return 0
+
+    import screensaver
+    modes = args.modes.split(',') if args.modes else [ mode for mode in screensaver.MODES if mode != 'Random' ]
+    if not args.corpus:
+        args.corpus = tempfile.mkdtemp(prefix='slideshow_corpus_')
+        start = time.time()
+        make_tree(args.corpus, args.images)
+        print('generated %d images in %.1fs' % (args.images, time.time() - start))
+    args.child_args = [
+        '--source', args.source, '--corpus', args.corpus, '--library', str(args.library),
+        '--duration', str(args.duration),
+    ] + [ '--set=%s' % setting for setting in args.set ]
+
+    results = []
+    for mode in modes:
+        profile = args.profile or tempfile.mkdtemp(prefix='slideshow_profile_')
+        results.append(run_child(mode, args, profile))
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
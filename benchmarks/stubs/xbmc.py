@@ -0,0 +1,83 @@
+# Stand-in for Kodi's xbmc module, only what screensaver.py uses.
+# executeJSONRPC answers from LIBRARY, a fake media library.
+
+import json
+import os
+import time
+
+LOGDEBUG = 0
+LOGINFO = 1
+LOGWARNING = 2
+LOGERROR = 3
+
+# Set BENCHMARK_LOG=1 to see the addon log on stdout
+VERBOSE = os.environ.get('BENCHMARK_LOG') == '1'
+
+# method -> (result key, items), every item has all properties
+LIBRARY = {}
+# Emulated duration of a JSON-RPC call in seconds
+JSONRPC_LATENCY = float(os.environ.get('BENCHMARK_JSONRPC_LATENCY', '0')) / 1000
+
+
+def log(msg, level=LOGDEBUG):
+    if VERBOSE:
+        print(msg)
+
+
+def sleep(milliseconds):
+    time.sleep(milliseconds / 1000.0)
+
+
+def executebuiltin(command, wait=False):
+    log('executebuiltin: %s' % command)
+
+
+def executeJSONRPC(query):
+    request = json.loads(query)
+    method = request.get('method')
+    params = request.get('params', {})
+    if JSONRPC_LATENCY:
+        time.sleep(JSONRPC_LATENCY)
+    if method not in LIBRARY:
+        return json.dumps({
+            'id': request.get('id'),
+            'jsonrpc': '2.0',
+            'error': {'code': -32601, 'message': 'Method not found.'},
+        })
+    key, items = LIBRARY[method]
+    total = len(items)
+    limits = params.get('limits', {})
+    start = min(limits.get('start', 0), total)
+    end = limits.get('end', -1)
+    if end < 0 or end > total:
+        end = total
+    properties = params.get('properties', [])
+    return json.dumps({
+        'id': request.get('id'),
+        'jsonrpc': '2.0',
+        'result': {
+            key: [
+                dict((name, value) for name, value in item.items() if name in properties or name == 'label')
+                for item in items[start:end]
+            ],
+            'limits': {'start': start, 'end': end, 'total': total},
+        },
+    })
+
+
+def getInfoLabel(label):
+    return ''
+
+
+def getCondVisibility(condition):
+    return VERBOSE
+
+
+class Monitor(object):
+
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=0):
+        time.sleep(timeout or 0)
+        return False
@@ -0,0 +1,44 @@
+# Stand-in for Kodi's xbmcaddon module. Settings default to the values of
+# resources/settings.xml and can be changed through SETTINGS.
+
+import os
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+ADDON_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROFILE_PATH = os.environ.get('BENCHMARK_PROFILE') or tempfile.mkdtemp(prefix='multi_slideshow_')
+
+
+def _default_settings():
+    settings = {}
+    tree = ElementTree.parse(os.path.join(ADDON_PATH, 'resources', 'settings.xml'))
+    for setting in tree.iter('setting'):
+        if setting.get('id'):
+            settings[setting.get('id')] = setting.get('default', '')
+    return settings
+
+
+SETTINGS = _default_settings()
+
+
+class Addon(object):
+
+    def __init__(self, id=None):
+        pass
+
+    def getAddonInfo(self, key):
+        return {
+            'id': 'script.screensaver.multi_slideshow',
+            'name': 'Multi Slideshow Screensaver',
+            'path': ADDON_PATH,
+            'profile': PROFILE_PATH + os.sep,
+        }[key]
+
+    def getSetting(self, key):
+        return SETTINGS.get(key, '')
+
+    def setSetting(self, key, value):
+        SETTINGS[key] = value
+
+    def getLocalizedString(self, string_id):
+        return 'string %d' % string_id
@@ -0,0 +1,151 @@
+# Stand-in for Kodi's xbmcgui module, controls only keep their state.
+# Every control and window operation is counted and timed in OPERATIONS.
+
+import functools
+import os
+import threading
+import time
+
+SCREEN_WIDTH = 1920
+SCREEN_HEIGHT = 1080
+
+# Emulated duration of a call into Kodi in seconds
+CONTROL_LATENCY = float(os.environ.get('BENCHMARK_CONTROL_LATENCY', '0')) / 1000
+
+# operation -> [count, seconds]
+OPERATIONS = {}
+_lock = threading.Lock()
+
+
+def reset_operations():
+    with _lock:
+        OPERATIONS.clear()
+
+
+def _operation(function):
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        if CONTROL_LATENCY:
+            time.sleep(CONTROL_LATENCY)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            duration = time.time() - start
+            with _lock:
+                operation = OPERATIONS.setdefault(name, [0, 0.0])
+                operation[0] += 1
+                operation[1] += duration
+    return wrapper
+
+
+class Control(object):
+
+    _next_id = 1
+
+    def __init__(self, x=0, y=0, width=0, height=0, *args, **kwargs):
+        self._id = Control._next_id
+        Control._next_id += 1
+        self._x = x
+        self._y = y
+        self._width = width
+        self._height = height
+        self._visible = True
+
+    def getId(self):
+        return self._id
+
+    @_operation
+    def setPosition(self, x, y):
+        self._x = x
+        self._y = y
+
+    def getWidth(self):
+        return self._width
+
+    @_operation
+    def setWidth(self, width):
+        self._width = width
+
+    def getHeight(self):
+        return self._height
+
+    @_operation
+    def setHeight(self, height):
+        self._height = height
+
+    @_operation
+    def setVisible(self, visible):
+        self._visible = visible
+
+    def isVisible(self):
+        return self._visible
+
+    @_operation
+    def setAnimations(self, animations):
+        pass
+
+
+class ControlImage(Control):
+
+    @_operation
+    def __init__(self, x, y, width, height, filename, aspectRatio=0, colorDiffuse=None):
+        Control.__init__(self, x, y, width, height)
+        self._filename = filename
+
+    @_operation
+    def setImage(self, filename, useCache=True):
+        self._filename = filename
+
+
+class ControlLabel(Control):
+
+    @_operation
+    def __init__(self, x, y, width, height, label, *args, **kwargs):
+        Control.__init__(self, x, y, width, height)
+        self._label = label
+
+    @_operation
+    def setLabel(self, label='', *args, **kwargs):
+        self._label = label
+
+
+class Window(object):
+
+    def __init__(self, existingWindowId=-1):
+        pass
+
+    def getWidth(self):
+        return SCREEN_WIDTH
+
+    def getHeight(self):
+        return SCREEN_HEIGHT
+
+
+class WindowDialog(Window):
+
+    @_operation
+    def show(self):
+        pass
+
+    @_operation
+    def close(self):
+        pass
+
+    @_operation
+    def addControl(self, control):
+        pass
+
+    @_operation
+    def addControls(self, controls):
+        pass
+
+    @_operation
+    def removeControl(self, control):
+        pass
+
+    @_operation
+    def removeControls(self, controls):
+        pass
@@ -0,0 +1,97 @@
+# Stand-in for Kodi's xbmcvfs module working on the local file system
+
+import os
+import tempfile
+
+TEMP_PATH = tempfile.mkdtemp(prefix='multi_slideshow_temp_')
+
+
+def translatePath(path):
+    return path.replace('special://temp/', TEMP_PATH + os.sep)
+
+
+def validatePath(path):
+    return path.replace('//', '/')
+
+
+def listdir(path):
+    # Like Kodi, a missing directory is just empty
+    directories = []
+    files = []
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        entries = []
+    for entry in entries:
+        if entry.is_dir():
+            directories.append(entry.name)
+        else:
+            files.append(entry.name)
+    return directories, files
+
+
+def exists(path):
+    return os.path.exists(path)
+
+
+def mkdirs(path):
+    os.makedirs(path, exist_ok=True)
+    return True
+
+
+def delete(path):
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+class Stat(object):
+
+    def __init__(self, path):
+        try:
+            self._stat = os.stat(path)
+        except OSError:
+            self._stat = None
+
+    def st_size(self):
+        return self._stat.st_size if self._stat else 0
+
+    def st_mtime(self):
+        return int(self._stat.st_mtime) if self._stat else 0
+
+
+class File(object):
+
+    def __init__(self, path, mode='r'):
+        try:
+            self._file = open(path, 'wb' if mode == 'w' else 'rb')
+        except (IOError, OSError):
+            self._file = None
+
+    def readBytes(self, numBytes=0):
+        if self._file is None:
+            return bytearray()
+        return bytearray(self._file.read(numBytes if numBytes > 0 else -1))
+
+    def seek(self, seekBytes, iWhence=0):
+        if self._file is None:
+            return -1
+        return self._file.seek(seekBytes, iWhence)
+
+    def size(self):
+        if self._file is None:
+            return 0
+        return os.fstat(self._file.fileno()).st_size
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -17,23 +17,43 @@
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import bisect
+from array import array
 import random
 import sys
 import simplejson as json
-from PIL import Image, ExifTags
-from os import path, remove
+from PIL import Image, ImageDraw, ImageFont
+from os import path, remove, replace
+import hashlib
+from io import BytesIO
+import heapq
+import math
+import pickle
+import queue
 import re
+import struct
 import threading
 import time
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import CancelledError, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
 
 import xbmc
 import xbmcaddon
 import xbmcvfs
-from xbmcgui import ControlImage, ControlLabel, WindowDialog, Window, DialogProgress
+from xbmcgui import ControlImage, WindowDialog, Window
 
 addon = xbmcaddon.Addon()
 ADDON_NAME = addon.getAddonInfo('name')
 ADDON_PATH = addon.getAddonInfo('path')
+PROFILE_PATH = xbmcvfs.translatePath(addon.getAddonInfo('profile'))
+# Debug messages are not even sent to Kodi if its debug log is disabled
+DEBUG_LOGGING = xbmc.getCondVisibility('System.GetBool(debug.showloginfo)')
 
 MODES = (
     'TableDrop',
@@ -54,8 +74,52 @@ PROPS = (
     'fanart',
     'thumbnail',
 )
-CHUNK_WAIT_TIME = 250
 ACTION_IDS_EXIT = [9, 10, 13, 92]
+IMAGE_EXTENSIONS = ('jpg', 'png', 'bmp')
+FOLDER_INDEX_FILE = path.join(PROFILE_PATH, 'folder_index.pickle')
+FOLDER_INDEX_VERSION = 2
+METADATA_CACHE_FILE = path.join(PROFILE_PATH, 'metadata_cache.pickle')
+METADATA_CACHE_VERSION = 1
+METADATA_CACHE_SIZE = 100000
+ORIENTATION_ROTATIONS = {3: 180, 6: 270, 8: 90}
+PLAYLIST_STATE_FILE = path.join(PROFILE_PATH, 'playlist_state.pickle')
+PLAYLIST_STATE_VERSION = 2
+MAX_REPEAT_SKIPS = 100
+WARM_START_FILE = path.join(PROFILE_PATH, 'warm_start.pickle')
+WARM_START_VERSION = 1
+LIBRARY_CACHE_FILE = path.join(PROFILE_PATH, 'library_cache.pickle')
+LIBRARY_CACHE_VERSION = 1
+LIBRARY_PAGE_SIZE = 500
+LIBRARY_NOTIFICATIONS = (
+    'VideoLibrary.OnScanFinished',
+    'VideoLibrary.OnCleanFinished',
+    'VideoLibrary.OnUpdate',
+    'VideoLibrary.OnRemove',
+    'AudioLibrary.OnScanFinished',
+    'AudioLibrary.OnCleanFinished',
+    'AudioLibrary.OnUpdate',
+    'AudioLibrary.OnRemove',
+)
+EXIF_ORIENTATION = 0x0112
+EXIF_IFD_POINTER = 0x8769
+EXIF_DATETIMEORIGINAL = 0x9003
+HEADER_CHUNK_SIZE = 16384
+IMAGE_FORMATS = {'.jpg': 'JPEG', '.png': 'PNG', '.bmp': 'BMP'}
+PREPARE_TIME_SAMPLES = 20
+PREFETCH_RESERVE = 2
+RENDER_TIMEOUT = 30
+ASPECT_MATCH_MAX_SKIPS = 4
+METRICS_FILE = xbmcvfs.translatePath('special://temp/multi_slideshow_metrics.json')
+METRICS_DUMP_INTERVAL = 60
+DERIVATIVE_CACHE_PATH = path.join(PROFILE_PATH, 'derivatives')
+DERIVATIVE_INDEX_FILE = path.join(PROFILE_PATH, 'derivative_index.pickle')
+DERIVATIVE_INDEX_VERSION = 1
+CAPTION_CACHE_PATH = path.join(PROFILE_PATH, 'captions')
+CAPTION_INDEX_FILE = path.join(PROFILE_PATH, 'caption_index.pickle')
+CAPTION_CACHE_SIZE = 16 * 1024 * 1024
+CAPTION_FONT = xbmcvfs.translatePath('special://xbmc/media/Fonts/arial.ttf')
+CAPTION_FONT_SIZE = 24
+CAPTION_OUTLINE = 2
 
 
 class ScreensaverManager(object):
@@ -73,12 +137,18 @@ class ScreensaverManager(object):
 
 class ExitMonitor(xbmc.Monitor):
 
-    def __init__(self, exit_callback):
+    def __init__(self, exit_callback, library_callback=None):
         self.exit_callback = exit_callback
+        self.library_callback = library_callback
 
     def onScreensaverDeactivated(self):
         self.exit_callback()
 
+    def onNotification(self, sender, method, data):
+        if ( self.library_callback is not None and method in LIBRARY_NOTIFICATIONS ):
+            # 'VideoLibrary' or 'AudioLibrary'
+            self.library_callback(method.split('.')[0])
+
 
 class ScreensaverWindow(WindowDialog):
 
@@ -91,110 +161,1647 @@ class ScreensaverWindow(WindowDialog):
             self.exit_callback()
 
 
+class FolderIndex(object):
+
+    # On-disk index of the image folder tree. For every directory the mtime,
+    # the subdirectories and the image files are stored, so a later
+    # activation only needs to re-list directories whose mtime has changed.
+
+    def __init__(self, index_file=FOLDER_INDEX_FILE):
+        self.index_file = index_file
+        self.entries = {}
+        self.seen = set()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+    def load(self):
+        start = time.time()
+        entries = load_pickle(self.index_file, FOLDER_INDEX_VERSION)
+        if ( entries is None ):
+            self.log('no usable index found at %s' % repr(self.index_file))
+            return
+        self.entries = entries
+        self.log('loaded %d directories in %.3fs' % (len(self.entries), time.time() - start))
+
+
+    def save(self):
+        # Drop directories which have not been visited during this walk,
+        # they have been deleted or are not part of the image path anymore
+        if ( len(self.seen) != len(self.entries) ):
+            self.entries = dict((k, v) for k, v in self.entries.items() if k in self.seen)
+            self.dirty = True
+        if ( self.dirty is False ):
+            return
+        if not save_pickle(self.index_file, FOLDER_INDEX_VERSION, self.entries):
+            self.log('error saving index to %s' % repr(self.index_file))
+            return
+        self.dirty = False
+        self.log('saved %d directories (%d hits, %d misses)' % (len(self.entries), self.hits, self.misses))
+
+
+    def clear(self):
+        self.entries = {}
+        self.seen = set()
+        try:
+            remove(self.index_file)
+            self.log('index %s deleted' % repr(self.index_file))
+        except OSError:
+            pass
+
+
+    def listdir(self, directory, listdir=xbmcvfs.listdir):
+        # Called from the scanner workers, only the bookkeeping is locked
+        mtime = xbmcvfs.Stat(directory).st_mtime()
+        with self.lock:
+            self.seen.add(directory)
+            entry = self.entries.get(directory)
+            # Some file systems do not report a directory mtime, never trust
+            # the index for those
+            if ( entry is not None and mtime and entry[0] == mtime ):
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+        directories, files = listdir(directory)
+        files = [ f for f in files if is_image(f) ]
+        with self.lock:
+            self.entries[directory] = (mtime, directories, files)
+            self.dirty = True
+        return directories, files
+
+
+    def log(self, msg, level=xbmc.LOGDEBUG):
+        log_message('FolderIndex: %s' % msg, level)
+
+
+class FolderScanner(object):
+
+    # Walks the image folder trees and lists every directory exactly once.
+    # The same listing provides the subdirectories to descend into and the
+    # image files, which is what matters on SMB/NFS shares.
+    # Every directory listing is a job for a bounded pool of workers, so
+    # several roots and all their subtrees are listed at the same time and
+    # the walk takes about as long as its slowest branch.
+
+    def __init__(self, recursive=True, folder_index=None, workers=1, metrics=None):
+        self.recursive = recursive
+        self.folder_index = folder_index
+        self.metrics = metrics or Metrics()
+        self.workers = max(1, workers)
+        self.pending = set()
+        self.dir_count = 0
+        self.listdir_count = 0
+        self.lock = threading.Lock()
+
+
+    def listdir(self, directory):
+        with self.lock:
+            self.listdir_count += 1
+        with self.metrics.timer('listing'):
+            return xbmcvfs.listdir(directory)
+
+
+    def list_directory(self, directory, depth):
+        if self.folder_index is not None:
+            directories, files = self.folder_index.listdir(directory, self.listdir)
+        else:
+            directories, files = self.listdir(directory)
+
+        sub_directories = []
+        if ( self.recursive is True or depth == 0 ):
+            sub_directories = [
+                xbmcvfs.validatePath('/'.join((directory, sub_directory, '')))
+                for sub_directory in directories
+                if not sub_directory.startswith('.')
+            ]
+        images = [
+            xbmcvfs.validatePath(directory + f) for f in files
+            if is_image(f)
+        ]
+        return directory, depth, sub_directories, images
+
+
+    def walk(self, roots):
+        # Yields (directory, images) for the roots and their subdirectories
+        # depth first in listing order, like os.walk, so the order does not
+        # depend on which listing completes first. Subdirectories are
+        # submitted as soon as their parent is listed. Directories with a
+        # leading dot are skipped, without recursion only the first level
+        # below each root is visited.
+        if isinstance(roots, str):
+            roots = [ roots ]
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        # Nested or duplicate roots must not list a directory twice
+        visited = set()
+        # Listing -> listings of its subdirectories
+        children = {}
+
+        def submit(directory, depth):
+            if directory in visited:
+                return None
+            visited.add(directory)
+            future = executor.submit(self.list_directory, directory, depth)
+            self.pending.add(future)
+            return future
+
+        def expand(future):
+            directory, depth, sub_directories, images = future.result()
+            children[future] = [
+                child for child in (submit(sub_directory, depth + 1) for sub_directory in sub_directories)
+                if child is not None
+            ]
+
+        self.pending = set()
+        stack = [ submit(xbmcvfs.validatePath('/'.join((root, ''))), 0) for root in roots ]
+        stack = [ future for future in reversed(stack) if future is not None ]
+        try:
+            while stack:
+                # Let the other listings go on while waiting for the next one
+                # to release
+                while stack[-1] in self.pending:
+                    done, self.pending = wait(self.pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        expand(future)
+                future = stack.pop()
+                directory, depth, sub_directories, images = future.result()
+                stack.extend(reversed(children.pop(future)))
+                self.dir_count += 1
+                yield directory, images
+        finally:
+            # The consumer may stop early (e.g. on exit), drop what is left
+            for future in self.pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+class MetadataCache(object):
+
+    # Persistent cache of the image metadata (orientation, date taken and
+    # dimensions) keyed by path. An entry is only valid as long as size and
+    # mtime of the file are unchanged. Beyond max_entries the least recently
+    # used entries are dropped.
+
+    def __init__(self, cache_file=METADATA_CACHE_FILE, max_entries=METADATA_CACHE_SIZE):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+    def load(self):
+        start = time.time()
+        entries = load_pickle(self.cache_file, METADATA_CACHE_VERSION)
+        if ( entries is None ):
+            self.log('no usable cache found at %s' % repr(self.cache_file))
+            return
+        self.entries = entries
+        self.log('loaded %d entries in %.3fs' % (len(self.entries), time.time() - start))
+
+
+    def save(self):
+        if ( self.dirty is False ):
+            return
+        if not save_pickle(self.cache_file, METADATA_CACHE_VERSION, self.entries):
+            self.log('error saving cache to %s' % repr(self.cache_file))
+            return
+        self.dirty = False
+        self.log('saved %d entries (%d hits, %d misses)' % (len(self.entries), self.hits, self.misses))
+
+
+    def get(self, image_url):
+        # Returns (size, mtime, orientation, date, width, height) of the image
+        stat = xbmcvfs.Stat(image_url)
+        size = stat.st_size()
+        mtime = stat.st_mtime()
+        with self.lock:
+            entry = self.entries.get(image_url)
+            if ( entry is not None and entry[0] == size and entry[1] == mtime ):
+                self.hits += 1
+                self.entries.move_to_end(image_url)
+                return entry
+            self.misses += 1
+        try:
+            metadata = read_image_header(image_url)
+        except (ValueError, struct.error):
+            self.log('header not parsable, using PIL: %s' % repr(image_url))
+            metadata = read_image_metadata(image_url)
+        entry = (size, mtime) + metadata
+        with self.lock:
+            self.entries[image_url] = entry
+            self.entries.move_to_end(image_url)
+            while ( len(self.entries) > self.max_entries ):
+                self.entries.popitem(last=False)
+            self.dirty = True
+        return entry
+
+
+    def log(self, msg, level=xbmc.LOGDEBUG):
+        log_message('MetadataCache: %s' % msg, level)
+
+
+class DerivativeCache(object):
+
+    # Persistent cache of images derived from a source image (e.g. rotated
+    # ones). Files are named by a hash of the source identity (path, size,
+    # mtime) and the kind of derivative, so equal file names in different
+    # folders can not collide and a changed source is never served stale.
+    # The cache is kept below max_bytes by dropping the least recently used
+    # files.
+
+    def __init__(self, max_bytes, cache_path=DERIVATIVE_CACHE_PATH, index_file=DERIVATIVE_INDEX_FILE):
+        self.max_bytes = max_bytes
+        self.cache_path = cache_path
+        self.index_file = index_file
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+
+    def load(self):
+        entries = load_pickle(self.index_file, DERIVATIVE_INDEX_VERSION)
+        if ( entries is not None ):
+            self.entries = entries
+            self.total_bytes = sum(self.entries.values())
+        xbmcvfs.mkdirs(self.cache_path)
+        self.remove_temp_files()
+        self.log('loaded %d files with %d bytes' % (len(self.entries), self.total_bytes))
+        self.evict()
+
+
+    def remove_temp_files(self):
+        # Drops the temporary files of renders that were killed before
+        # they could clean up after themselves
+        try:
+            filenames = os.listdir(self.cache_path)
+        except OSError:
+            return
+        for filename in filenames:
+            if not filename.endswith('.tmp'):
+                continue
+            self.log('removing temporary file %s' % repr(filename))
+            try:
+                remove(path.join(self.cache_path, filename))
+            except OSError:
+                pass
+
+
+    def save(self):
+        if ( self.dirty is False ):
+            return
+        if not save_pickle(self.index_file, DERIVATIVE_INDEX_VERSION, self.entries):
+            self.log('error saving index to %s' % repr(self.index_file))
+            return
+        self.dirty = False
+        self.log('saved %d files with %d bytes (%d hits, %d misses, %d evictions)' % (
+            len(self.entries), self.total_bytes, self.hits, self.misses, self.evictions
+        ))
+
+
+    def key(self, image_url, size, mtime, variant):
+        identity = '%s|%d|%d|%s' % (image_url, size, mtime, variant)
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+    def filepath(self, key, image_url):
+        return path.join(self.cache_path, key + path.splitext(image_url)[1].lower())
+
+
+    def get(self, key, image_url):
+        # Returns the path of the cached derivative or None
+        filepath = self.filepath(key, image_url)
+        with self.lock:
+            if ( key in self.entries ):
+                if path.exists(filepath):
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    self.dirty = True
+                    return filepath
+                # Removed from outside, forget about it
+                self.total_bytes -= self.entries.pop(key)
+            self.misses += 1
+        return None
+
+
+    def add(self, key, filepath):
+        try:
+            size = path.getsize(filepath)
+        except OSError:
+            return
+        with self.lock:
+            self.total_bytes += size - self.entries.get(key, 0)
+            self.entries[key] = size
+            self.entries.move_to_end(key)
+            self.dirty = True
+            self.evict()
+
+
+    def evict(self):
+        with self.lock:
+            while ( self.total_bytes > self.max_bytes and len(self.entries) > 1 ):
+                key, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                self.evictions += 1
+                self.dirty = True
+                for filename in (key + ext for ext in IMAGE_FORMATS):
+                    try:
+                        remove(path.join(self.cache_path, filename))
+                    except OSError:
+                        pass
+
+
+    def log(self, msg, level=xbmc.LOGDEBUG):
+        log_message('DerivativeCache: %s' % msg, level)
+
+
+class CaptionRenderer(object):
+
+    # Renders the captions once into small images of white text with a
+    # black outline, as Kodi has no outlined labels. A panel then needs a
+    # single image control for its caption. The images are kept in their
+    # own derivative cache, keyed by the text and the font size.
+
+    def __init__(self, pixel_scale):
+        self.pixel_scale = pixel_scale
+        self.font_size = max(1, int(round(CAPTION_FONT_SIZE * pixel_scale)))
+        self.cache = DerivativeCache(CAPTION_CACHE_SIZE, CAPTION_CACHE_PATH, CAPTION_INDEX_FILE)
+        self.font = None
+        # Sizes of the captions rendered or looked at in this activation
+        self.sizes = {}
+        self.lock = threading.Lock()
+
+
+    def get(self, text):
+        # Returns (filepath, width, height) of the caption, the size in skin
+        # coordinates, or None if there is nothing to show
+        if not text:
+            return None
+        with self.lock:
+            if ( self.font is None ):
+                self.cache.load()
+                self.font = load_caption_font(self.font_size)
+            key = self.cache.key(text, self.font_size, CAPTION_OUTLINE, 'caption')
+            filepath = self.cache.get(key, 'caption.png')
+            size = self.sizes.get(key)
+            if ( filepath is None ):
+                filepath = self.cache.filepath(key, 'caption.png')
+                size = render_caption(text, filepath, self.font)
+                self.cache.add(key, filepath)
+            elif ( size is None ):
+                with Image.open(filepath) as image:
+                    size = image.size
+            self.sizes[key] = size
+        return filepath, size[0] / self.pixel_scale, size[1] / self.pixel_scale
+
+
+    def save(self):
+        self.cache.save()
+
+
+class LibraryCache(object):
+
+    # Persistent copy of the image lists queried from the video and audio
+    # library, keyed by (method, property). A library notification drops
+    # the lists of that library, including those still being fetched. As
+    # notifications are only received while the screensaver runs, the item
+    # count of the library is compared as well before a list is used.
+
+    def __init__(self, cache_file=LIBRARY_CACHE_FILE):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.invalidated = set()
+        self.loaded = False
+        self.dirty = False
+        self.lock = threading.Lock()
+
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            entries = load_pickle(self.cache_file, LIBRARY_CACHE_VERSION)
+            if ( entries is None ):
+                self.log('no usable cache found at %s' % repr(self.cache_file))
+                return
+            self.entries = entries
+        self.log('loaded %d lists' % len(self.entries))
+
+
+    def save(self):
+        with self.lock:
+            if ( self.dirty is False ):
+                return
+            if not save_pickle(self.cache_file, LIBRARY_CACHE_VERSION, self.entries):
+                self.log('error saving cache to %s' % repr(self.cache_file))
+                return
+            self.dirty = False
+        self.log('saved %d lists' % len(self.entries))
+
+
+    def get(self, method, prop, total):
+        # Returns the cached images if the library still has total items
+        with self.lock:
+            entry = self.entries.get((method, prop))
+            if ( entry is None or entry[0] != total ):
+                return None
+            return entry[1]
+
+
+    def put(self, method, prop, total, images):
+        with self.lock:
+            if ( method.split('.')[0] in self.invalidated ):
+                return
+            self.entries[(method, prop)] = (total, images)
+            self.dirty = True
+
+
+    def invalidate(self, library):
+        self.load()
+        with self.lock:
+            self.invalidated.add(library)
+            for method, prop in list(self.entries):
+                if ( method.split('.')[0] == library ):
+                    del self.entries[(method, prop)]
+                    self.dirty = True
+        self.log('%s changed' % library)
+        self.save()
+
+
+    def log(self, msg, level=xbmc.LOGDEBUG):
+        log_message('LibraryCache: %s' % msg, level)
+
+
+class Playlist(object):
+
+    # Images in display order. Images are added while the sources are still
+    # being walked. Every source has its own lane, the lanes take turns by
+    # their weights (smooth weighted round robin), independent of how many
+    # images each source has. The lanes share one table of path prefixes.
+    # Images shown within the last window images are skipped if possible.
+    # state() returns what is needed to continue the lanes with the next
+    # activation.
+
+    def __init__(self, random_order=False, weights=None, window=0, state=None):
+        self.random_order = random_order
+        self.weights = weights or {}
+        self.prefixes = PrefixTable()
+        self.lanes = OrderedDict()
+        self.recent = RecentImages(window)
+        self.saved_lanes = {}
+        if ( state is not None ):
+            self.saved_lanes = state['lanes']
+            self.recent.load(state['recent'])
+        self.complete = False
+        self.closed = False
+        self.condition = threading.Condition()
+
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes.values())
+
+
+    def extend(self, images, source=None):
+        with self.condition:
+            lane = self.lanes.get(source)
+            if ( lane is None ):
+                lane = self.lanes[source] = PlaylistLane(
+                    self.prefixes, self.weights.get(source, 1), self.random_order,
+                    self.saved_lanes.get(source)
+                )
+            lane.extend(images)
+            self.condition.notify_all()
+
+
+    def finish(self):
+        with self.condition:
+            self.complete = True
+            self.condition.notify_all()
+
+
+    def close(self):
+        # Wakes up and ends all waiting consumers
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+    def state(self):
+        with self.condition:
+            return {
+                'lanes': dict((source, lane.state()) for source, lane in self.lanes.items()),
+                'recent': self.recent.save(),
+            }
+
+
+    def available_lanes(self):
+        return [
+            lane for lane in self.lanes.values()
+            if lane.available(self.complete)
+        ]
+
+
+    def next(self, timeout=None):
+        # Returns the next image or None if none became available in time
+        # or the playlist has been closed
+        with self.condition:
+            available = self.condition.wait_for(
+                lambda: self.closed or self.available_lanes(),
+                timeout
+            )
+            if ( not available or self.closed ):
+                return None
+            lanes = self.available_lanes()
+            for lane in lanes:
+                lane.credit += lane.weight
+            lane = max(lanes, key=lambda lane: lane.credit)
+            lane.credit -= sum(lane.weight for lane in lanes)
+            image = lane.next(self.complete)
+            # A lane smaller than the window has to repeat itself anyway
+            if ( len(lane) > self.recent.window ):
+                skips = min(len(lane), MAX_REPEAT_SKIPS)
+                while ( image in self.recent and skips and lane.available(self.complete) ):
+                    image = lane.next(self.complete)
+                    skips -= 1
+            self.recent.add(image)
+            return image
+
+
+class PlaylistLane(object):
+
+    # The images of one source in a Playlist. Instead of a string per image
+    # every entry is the id of its interned prefix (the directory) and the
+    # rest of the path, utf-8 encoded into one shared buffer. That is about
+    # 30 bytes per image instead of well over 100.
+    # In random order a pass over the entries follows a seeded Permutation,
+    # no shuffled copy exists. While the source is still being walked a new
+    # pass over all entries starts whenever they have doubled, so the first
+    # images do not all come from the first directories.
+    # A saved state names the next image by its path, as the entries may
+    # have changed since. The lane seeks to it once it has been added and
+    # serves from the start until then. In random order the saved pass is
+    # only continued if that image is still where the pass expects it. If
+    # the image is gone, the lane continues at the saved position once the
+    # source is complete.
+
+    def __init__(self, prefixes, weight=1, random_order=False, state=None):
+        self.prefixes = prefixes
+        self.weight = weight
+        self.random_order = random_order
+        self.prefix_ids = array('I')
+        self.offsets = array('L', [0])
+        self.names = bytearray()
+        self.position = 0
+        self.size = 0
+        self.seed = None
+        self.permutation = None
+        self.saved_state = None
+        self.resume_index = None
+        if ( state is not None and (state['seed'] is not None) == random_order ):
+            self.saved_state = state
+        self.credit = 0
+
+
+    def __len__(self):
+        return len(self.prefix_ids)
+
+
+    def __getitem__(self, index):
+        return self.prefixes[self.prefix_ids[index]] + self.names[
+            self.offsets[index]:self.offsets[index + 1]
+        ].decode('utf-8', 'surrogatepass')
+
+
+    def extend(self, images):
+        names = self.names
+        last_prefix = prefix_id = None
+        resume_image = self.saved_state and self.saved_state['image']
+        for image in images:
+            if ( image == resume_image and self.resume_index is None ):
+                self.resume_index = len(self.prefix_ids)
+            # Split after the last slash, ignoring a trailing one (image://
+            # urls). The images of a batch mostly share their directory.
+            split = image.rfind('/', 0, len(image) - 1) + 1
+            prefix = image[:split]
+            if ( prefix != last_prefix ):
+                last_prefix = prefix
+                prefix_id = self.prefixes.intern(prefix)
+            self.prefix_ids.append(prefix_id)
+            names += image[split:].encode('utf-8', 'surrogatepass')
+            self.offsets.append(len(names))
+
+
+    def available(self, complete):
+        count = len(self)
+        if ( count == 0 ):
+            return False
+        if complete:
+            return True
+        if self.random_order:
+            return self.position < self.size or count > self.size
+        return self.position < count
+
+
+    def next(self, complete):
+        count = len(self)
+        if ( self.saved_state is not None ):
+            self.restore(complete)
+        if self.random_order:
+            if ( self.position >= self.size or (not complete and count >= 2 * self.size) ):
+                self.start_pass(count)
+            index = self.permutation[self.position]
+        else:
+            if ( self.position >= count ):
+                self.position = 0
+            index = self.position
+        self.position += 1
+        return self[index]
+
+
+    def start_pass(self, size, seed=None):
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.size = size
+        self.permutation = Permutation(size, self.seed)
+        self.position = 0
+
+
+    def restore(self, complete):
+        # Applies the saved state as soon as it is known whether it fits
+        state = self.saved_state
+        if not self.random_order:
+            if ( self.resume_index is not None ):
+                self.position = self.resume_index
+            elif complete:
+                # The image is gone, continue about where it was
+                self.position = min(state['position'], len(self))
+            else:
+                return
+        elif ( self.resume_index == state['index'] and state['size'] <= len(self) ):
+            self.start_pass(state['size'], state['seed'])
+            self.position = state['position']
+        elif ( not complete and self.resume_index in (None, state['index']) ):
+            return
+        # Otherwise the entries have changed, the pass can not be continued
+        # and the one already started is as good
+        self.saved_state = None
+        self.resume_index = None
+
+
+    def state(self):
+        if ( self.saved_state is not None ):
+            # Not restored yet
+            return self.saved_state
+        count = len(self)
+        if self.random_order:
+            if ( self.position < self.size ):
+                index = self.permutation[self.position]
+                return {'size': self.size, 'seed': self.seed, 'position': self.position,
+                        'index': index, 'image': self[index]}
+            return {'size': self.size, 'seed': self.seed, 'position': self.position,
+                    'index': None, 'image': None}
+        if ( count == 0 ):
+            return {'size': 0, 'seed': None, 'position': 0, 'index': None, 'image': None}
+        index = self.position % count
+        return {'size': count, 'seed': None, 'position': index, 'index': index, 'image': self[index]}
+
+
+class Permutation(object):
+
+    # Seeded bijection of range(size): a balanced Feistel network over the
+    # smallest even power of two covering size, walking the cycle until the
+    # result is within range. Any position maps to its index in O(1)
+    # (less than four rounds of walking on average).
+
+    ROUNDS = 4
+
+    def __init__(self, size, seed):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        generator = random.Random(seed)
+        self.keys = [ generator.getrandbits(32) for i in range(self.ROUNDS) ]
+
+
+    def __len__(self):
+        return self.size
+
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.size:
+            raise IndexError(position)
+        value = position
+        while True:
+            left, right = value >> self.half_bits, value & self.mask
+            for key in self.keys:
+                mixed = ((right ^ key) * 0x9E3779B1) & 0xFFFFFFFF
+                left, right = right, (left ^ (mixed >> 16) ^ mixed) & self.mask
+            value = (left << self.half_bits) | right
+            if ( value < self.size ):
+                return value
+
+
+class RecentImages(object):
+
+    # The last window images shown, as crc32 of their paths so they can be
+    # saved with the playlist state
+
+    def __init__(self, window=0):
+        self.window = window
+        self.keys = deque()
+        self.counts = {}
+
+
+    def __contains__(self, image):
+        return self.window > 0 and self.key(image) in self.counts
+
+
+    def key(self, image):
+        return zlib.crc32(image.encode('utf-8', 'surrogatepass'))
+
+
+    def add(self, image):
+        if ( self.window <= 0 ):
+            return
+        self.add_key(self.key(image))
+
+
+    def add_key(self, key):
+        self.keys.append(key)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        while ( len(self.keys) > self.window ):
+            old_key = self.keys.popleft()
+            self.counts[old_key] -= 1
+            if ( self.counts[old_key] == 0 ):
+                del self.counts[old_key]
+
+
+    def load(self, keys):
+        for key in keys[-self.window:] if self.window > 0 else []:
+            self.add_key(key)
+
+
+    def save(self):
+        return list(self.keys)
+
+
+class PrefixTable(object):
+
+    # Interned path prefixes, a prefix is stored once and referenced by id
+
+    def __init__(self):
+        self.prefixes = []
+        self.ids = {}
+
+
+    def __len__(self):
+        return len(self.prefixes)
+
+
+    def __getitem__(self, prefix_id):
+        return self.prefixes[prefix_id]
+
+
+    def intern(self, prefix):
+        prefix_id = self.ids.get(prefix)
+        if ( prefix_id is None ):
+            prefix_id = self.ids[prefix] = len(self.prefixes)
+            self.prefixes.append(prefix)
+        return prefix_id
+
+
+class PrefetchBuffer(object):
+
+    # FIFO of prepared images and their hidden preload controls between the
+    # cacher (producer) and the slideshow (consumer). Every put and take is
+    # atomic and notifies the condition, which is also used by the cacher
+    # to wait for room. The same image may be in the buffer more than once,
+    # so small libraries fill it just as well. Next to the prepared image
+    # the url it has been prepared from, its size and its caption, if
+    # known, are kept.
+    # A take for a slot of a given aspect ratio may pick a later image
+    # which fits the slot better, but never passes over the oldest image
+    # more than ASPECT_MATCH_MAX_SKIPS times.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = deque()
+        self.closed = False
+        self.condition = threading.Condition()
+        self.puts = 0
+        self.takes = 0
+        self.stalls = 0
+        self.peak = 0
+        self.occupancy = 0
+        self.head_skips = 0
+        self.matches = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def set_capacity(self, capacity):
+        with self.condition:
+            self.capacity = max(1, capacity)
+            self.condition.notify_all()
+
+
+    def has_room(self, reserved=0):
+        return len(self.entries) + reserved < self.capacity
+
+
+    def put(self, image_url, control, source_url=None, image_size=None, caption=None):
+        with self.condition:
+            self.entries.append((image_url, control, source_url or image_url, image_size, caption))
+            self.puts += 1
+            self.peak = max(self.peak, len(self.entries))
+            self.condition.notify_all()
+
+
+    def wait_for(self, count, timeout=None):
+        # Blocks until count entries are buffered, False if closed or timed
+        # out meanwhile
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or len(self.entries) >= count, timeout)
+            return not self.closed and len(self.entries) >= count
+
+
+    def take(self, reserve=0, aspect_ratio=None):
+        # Waits until more than reserve entries are buffered and returns
+        # the oldest (image_url, control, image_size, caption), or with an
+        # aspect_ratio the one fitting it best, None if closed meanwhile
+        with self.condition:
+            if ( len(self.entries) <= reserve ):
+                self.stalls += 1
+            if not self.wait_for(reserve + 1):
+                return None
+            self.occupancy += len(self.entries)
+            self.takes += 1
+            index = 0
+            if ( aspect_ratio is not None and self.head_skips < ASPECT_MATCH_MAX_SKIPS ):
+                index = self.best_match(aspect_ratio)
+            if ( index == 0 ):
+                self.head_skips = 0
+            else:
+                self.head_skips += 1
+                self.matches += 1
+            image_url, control, source_url, image_size, caption = self.entries[index]
+            del self.entries[index]
+            self.condition.notify_all()
+            return image_url, control, image_size, caption
+
+
+    def best_match(self, aspect_ratio):
+        # Index of the entry cropped least in a slot of aspect_ratio, the
+        # older one on a tie. Images of unknown size count as a good fit.
+        best_index = 0
+        best_cost = None
+        for index, entry in enumerate(self.entries):
+            image_size = entry[3]
+            if ( image_size is None ):
+                cost = 0.0
+            else:
+                cost = abs(math.log(float(image_size[0]) / image_size[1] / aspect_ratio))
+            if ( best_cost is None or cost < best_cost ):
+                best_index, best_cost = index, cost
+                if ( cost == 0.0 ):
+                    break
+        return best_index
+
+
+    def clear(self):
+        # Removes and returns all (image_url, control) entries
+        with self.condition:
+            entries = [ entry[:2] for entry in self.entries ]
+            self.entries.clear()
+            self.condition.notify_all()
+            return entries
+
+
+    def source_urls(self):
+        with self.condition:
+            return [ entry[2] for entry in self.entries ]
+
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify_all()
+
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'size': len(self.entries),
+            'peak': self.peak,
+            'puts': self.puts,
+            'takes': self.takes,
+            'stalls': self.stalls,
+            'aspect_matches': self.matches,
+            'average_occupancy': round(float(self.occupancy) / self.takes, 2) if self.takes else 0,
+        }
+
+
+class PreloadControlPool(object):
+
+    # Hidden image controls which keep the textures of the prefetched
+    # images loaded. A control is added to the window once and reused for
+    # later images by swapping its texture, instead of adding and removing
+    # a control per image. The controls are fully transparent rather than
+    # invisible, so Kodi keeps processing them and loads a swapped texture
+    # right away.
+
+    def __init__(self, window):
+        self.window = window
+        self.controls = []
+        self.free = []
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+
+    def acquire(self, image_url):
+        with self.lock:
+            control = self.free.pop() if self.free else None
+            if ( control is not None ):
+                self.reused += 1
+        if ( control is not None ):
+            control.setImage(image_url)
+            return control
+        control = ControlImage(0, 0, 1, 1, image_url, False, '0x00FFFFFF')
+        self.window.addControl(control)
+        with self.lock:
+            self.controls.append(control)
+            self.created += 1
+        return control
+
+
+    def release(self, control):
+        with self.lock:
+            self.free.append(control)
+
+
+    def clear(self):
+        # Removes and returns all controls
+        with self.lock:
+            controls = self.controls
+            self.controls = []
+            self.free = []
+            return controls
+
+
+    def stats(self):
+        return {
+            'controls': len(self.controls),
+            'created': self.created,
+            'reused': self.reused,
+            # Every reuse saves an addControl and a removeControl
+            'saved_calls': 2 * self.reused,
+        }
+
+
+class AnimationTimeline(object):
+
+    # Steps of the animations which are due later, so process_image does
+    # not have to sleep and several controls can be in transition at the
+    # same time. The slideshow thread runs the due steps whenever it
+    # waits. Every step has a key (the id of the control it animates), so
+    # a control can be let finish its transition before it gets the next
+    # image. close() wakes up all waits at once.
+
+    def __init__(self):
+        # (deadline, counter, key, callback), the counter keeps steps due
+        # at the same time in the order they have been scheduled
+        self.steps = []
+        self.counter = 0
+        self.keys = {}
+        self.closed = False
+        self.condition = threading.Condition()
+
+
+    def __len__(self):
+        return len(self.steps)
+
+
+    def schedule(self, delay, callback, key=None):
+        # Runs callback in delay milliseconds
+        heapq.heappush(self.steps, (time.monotonic() + delay / 1000.0, self.counter, key, callback))
+        self.counter += 1
+        self.keys[key] = self.keys.get(key, 0) + 1
+
+
+    def after(self, key, callback):
+        # Runs callback right after the last step of key scheduled so far,
+        # at once if there is none
+        if ( key not in self.keys ):
+            callback()
+            return
+        deadline = max(step[0] for step in self.steps if step[2] == key)
+        heapq.heappush(self.steps, (deadline, self.counter, key, callback))
+        self.counter += 1
+        self.keys[key] += 1
+
+
+    def pending(self, key=None):
+        if ( key is None ):
+            return bool(self.steps)
+        return key in self.keys
+
+
+    def time_to_next(self):
+        # Seconds until the next step is due, None if there is none
+        if not self.steps:
+            return None
+        return max(0.0, self.steps[0][0] - time.monotonic())
+
+
+    def run_due(self):
+        while ( self.steps and self.steps[0][0] <= time.monotonic() and not self.closed ):
+            deadline, counter, key, callback = heapq.heappop(self.steps)
+            self.keys[key] -= 1
+            if ( self.keys[key] == 0 ):
+                del self.keys[key]
+            callback()
+
+
+    def run_until(self, deadline):
+        # Runs the steps due until the monotonic deadline, False if closed
+        # meanwhile
+        while not self.closed:
+            self.run_due()
+            timeout = deadline - time.monotonic()
+            if ( timeout <= 0 ):
+                return True
+            if self.steps:
+                timeout = min(timeout, self.time_to_next())
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed, timeout)
+        return False
+
+
+    def finish(self, key=None):
+        # Runs the steps (of key) until none is left, False if closed
+        # meanwhile
+        while self.pending(key):
+            if not self.run_until(self.steps[0][0]):
+                return False
+        return not self.closed
+
+
+    def clear(self):
+        del self.steps[:]
+        self.keys.clear()
+
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class Cadence(object):
+
+    # Absolute deadlines for the image changes, so the time process_image
+    # and the prefetch buffer take is part of the interval instead of
+    # adding to it. Every deadline follows the previous one by the
+    # interval. A change more than an interval late starts the schedule
+    # anew from then instead of hurrying to catch up. The lateness of every
+    # change is recorded as jitter, deadlines which had passed before the
+    # wait even started as overruns.
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.base = None
+        self.deadline = None
+        self.changes = 0
+        self.overruns = 0
+        self.resets = 0
+
+
+    def next_deadline(self, interval):
+        # Monotonic time of the next change, interval in seconds
+        now = time.monotonic()
+        self.deadline = (self.base if self.base is not None else now) + interval
+        if ( self.deadline < now ):
+            self.overruns += 1
+            self.metrics.record('cadence_overrun', now - self.deadline)
+        return self.deadline
+
+
+    def changed(self, interval):
+        # The image has been changed, interval in seconds
+        now = time.monotonic()
+        self.changes += 1
+        if ( self.deadline is None ):
+            # Not scheduled, like the first images of a view
+            self.base = now
+            return
+        lateness = now - self.deadline
+        self.metrics.record('cadence_jitter', abs(lateness))
+        if ( lateness > interval ):
+            self.resets += 1
+            self.base = now
+        else:
+            self.base = self.deadline
+        self.deadline = None
+
+
+    def stats(self):
+        return {
+            'changes': self.changes,
+            'overruns': self.overruns,
+            'resets': self.resets,
+        }
+
+
+class Metrics(object):
+
+    # Latency histograms of the pipeline stages plus event counters, cheap
+    # enough to be always collected. Gauges are functions evaluated for
+    # every snapshot. With a metrics_file the snapshot is written as JSON
+    # every METRICS_DUMP_INTERVAL seconds and on exit.
+
+    # Upper bounds of the histogram buckets in milliseconds
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self, metrics_file=None):
+        self.metrics_file = metrics_file
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.last_dump = self.start_time
+
+
+    def record(self, stage, seconds):
+        milliseconds = seconds * 1000
+        bucket = bisect.bisect_left(self.BUCKETS, milliseconds)
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if ( histogram is None ):
+                histogram = self.histograms[stage] = {
+                    'count': 0,
+                    'total': 0.0,
+                    'max': 0.0,
+                    'buckets': [0] * (len(self.BUCKETS) + 1),
+                }
+            histogram['count'] += 1
+            histogram['total'] += milliseconds
+            histogram['max'] = max(histogram['max'], milliseconds)
+            histogram['buckets'][bucket] += 1
+
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, time.time() - start)
+
+
+    def count(self, name, increment=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + increment
+
+
+    def add_gauge(self, name, function):
+        self.gauges[name] = function
+
+
+    def snapshot(self):
+        with self.lock:
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                stages[stage] = {
+                    'count': histogram['count'],
+                    'mean_ms': round(histogram['total'] / histogram['count'], 2),
+                    'max_ms': round(histogram['max'], 2),
+                    'p50_ms': self.percentile(histogram, 0.5),
+                    'p90_ms': self.percentile(histogram, 0.9),
+                    'p99_ms': self.percentile(histogram, 0.99),
+                    'buckets': dict(zip(
+                        [ '<=%d' % bound for bound in self.BUCKETS ] + [ '>%d' % self.BUCKETS[-1] ],
+                        histogram['buckets']
+                    )),
+                }
+            counters = dict(self.counters)
+        return {
+            'time': int(time.time()),
+            'uptime': round(time.time() - self.start_time, 3),
+            'stages': stages,
+            'counters': counters,
+            'gauges': dict((name, function()) for name, function in self.gauges.items()),
+        }
+
+
+    def percentile(self, histogram, fraction):
+        # Upper bound of the bucket holding the percentile, the maximum for
+        # the open bucket
+        rank = fraction * histogram['count']
+        seen = 0
+        for bound, count in zip(self.BUCKETS, histogram['buckets']):
+            seen += count
+            if ( seen >= rank ):
+                return min(bound, round(histogram['max'], 2))
+        return round(histogram['max'], 2)
+
+
+    def dump_due(self):
+        return (
+            self.metrics_file is not None
+            and time.time() - self.last_dump >= METRICS_DUMP_INTERVAL
+        )
+
+
+    def dump(self):
+        # Atomically replaces the metrics file, returns False on errors
+        if ( self.metrics_file is None ):
+            return False
+        self.last_dump = time.time()
+        temp_file = self.metrics_file + '.tmp'
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+            replace(temp_file, self.metrics_file)
+        except (IOError, OSError, TypeError, ValueError) as error:
+            log_message('error writing metrics to %s: %r' % (repr(self.metrics_file), error), xbmc.LOGWARNING)
+            return False
+        return True
+
+
+class ImageFeeder(threading.Thread):
+
+    # Runs the image discovery in the background and feeds the playlist
+    # with every (source, images) batch as soon as it has been found.
+
+    def __init__(self, batches, playlist, metrics=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stop = threading.Event()
+        self.batches = batches
+        self.playlist = playlist
+        self.metrics = metrics or Metrics()
+
+
+    def run(self):
+        start = time.time()
+        first_batch = None
+        try:
+            for source, batch in self.batches:
+                if self.stop.is_set():
+                    self.batches.close()
+                    break
+                self.playlist.extend(batch, source)
+                if ( first_batch is None ):
+                    first_batch = time.time() - start
+                    self.metrics.record('first_batch', first_batch)
+                    self.log('first %d images after %.3fs' % (len(batch), first_batch))
+        finally:
+            self.playlist.finish()
+        self.metrics.record('discovery', time.time() - start)
+        self.log('%d images found in %.3fs' % (len(self.playlist), time.time() - start))
+
+
+    def log(self, msg, level=xbmc.LOGDEBUG):
+        log_message('ImageFeeder: %s' % msg, level)
+
+
 class Cache(threading.Thread): 
 
-    def __init__(self, images): 
+    # Prepares the upcoming images of the playlist (metadata, rotation,
+    # scaling) with a pool of workers and hands them over as preloaded
+    # image controls. Preparation goes on while the cacher is paused, only
+    # the control creation waits for it and is done by this thread alone,
+    # always in playlist order.
+    # The images prepared but not shown are saved on exit and prepared
+    # first with the next activation, before the sources have been read.
+    # Those whose file has changed meanwhile are skipped.
+
+    def __init__(self, playlist, prefetch_buffer): 
         threading.Thread.__init__(self) 
         self.pause = threading.Event()
         self.stop = threading.Event()
         self.idle = threading.Event()
-        self.images = images
-        self.rotated_pictures = []
-        self.cache_cycle_image = cycle(self.images)
+        self.idle.set()
+        self.playlist = playlist
+        self.prefetch_buffer = prefetch_buffer
+        # (source url, future) of the images being prepared
+        self.pending = deque()
+        self.warm_start = addon.getSetting('resume_playlist') == 'true'
+        self.warm_images = deque()
+        self.metadata_cache = MetadataCache()
+        self.derivative_cache = DerivativeCache(
+            int(addon.getSetting('derivative_cache_size') or 200) * 1024 * 1024
+        )
+        self.metrics = screensaver.metrics
+        self.metrics.add_gauge('metadata_cache', lambda: {
+            'entries': len(self.metadata_cache.entries),
+            'hits': self.metadata_cache.hits,
+            'misses': self.metadata_cache.misses,
+        })
+        self.metrics.add_gauge('derivative_cache', lambda: {
+            'files': len(self.derivative_cache.entries),
+            'bytes': self.derivative_cache.total_bytes,
+            'hits': self.derivative_cache.hits,
+            'misses': self.derivative_cache.misses,
+            'evictions': self.derivative_cache.evictions,
+        })
+        # Largest size in screen pixels the current mode shows images with
+        self.derivative_size = None
+        if ( addon.getSetting('screen_derivatives') == 'true' ):
+            self.derivative_size = screensaver.get_derivative_size()
+            self.log('derivative size: %dx%d' % self.derivative_size)
+        # Only images from the folders are opened, the artwork of the
+        # library comes as image:// urls
+        self.prepare_paths = 'image_folder' in dict(screensaver.get_sources())
+        self.workers = max(1, int(addon.getSetting('prefetch_workers') or 1))
+        self.adaptive = addon.getSetting('adaptive_prefetch') == 'true'
+        self.prepare_times = deque(maxlen=PREPARE_TIME_SAMPLES)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.render_pool = None
+        if ( addon.getSetting('prefetch_processes') == 'true' ):
+            self.render_pool = create_render_pool(self.workers)
+            self.log('render processes: %s' % (self.render_pool is not None))
 
 
     def run(self):
+        self.metadata_cache.load()
+        self.derivative_cache.load()
+        self.load_warm_start()
+        condition = self.prefetch_buffer.condition
+        starved = False
         while True:
-            time.sleep(0.05)
-            if ( not self.pause.isSet() ):
-                if ( len(screensaver.preload_controls) < screensaver.FAST_IMAGE_COUNT):
-                    self.idle.clear()
-                    image_url = next(self.cache_cycle_image)
-                    self.preload_image(image_url)
-                    self.idle.set()
-            if ( self.stop.isSet() ):
-                return
+            # Sleep until another image can be prepared, the next prepared
+            # image can be handed over or we are told to stop. Every change
+            # of the cache and every finished preparation notifies the
+            # condition.
+            with condition:
+                condition.wait_for(lambda: self.stop.is_set() or (
+                    not starved and self.has_room()
+                ) or (
+                    not self.pause.is_set() and self.pending and self.pending[0][1].done()
+                ))
+            if self.stop.is_set():
+                break
+
+            # Keep the workers busy
+            starved = False
+            while self.has_room():
+                expected = None
+                if self.warm_images:
+                    image_url, expected = self.warm_images.popleft()
+                else:
+                    # Only block on the playlist if there is nothing else to do
+                    image_url = self.playlist.next(timeout=None if not self.pending else 0)
+                if ( image_url is None ):
+                    starved = True
+                    break
+                future = self.executor.submit(self.timed_prepare_image, image_url, expected)
+                future.add_done_callback(lambda future: self.notify())
+                self.pending.append((image_url, future))
+
+            # Hand over the prepared images in playlist order
+            while ( not self.pause.is_set() and self.pending and self.pending[0][1].done() ):
+                source_url, future = self.pending.popleft()
+                try:
+                    prepared = future.result()
+                except Exception as error:
+                    self.log('error preparing image: %r' % error, xbmc.LOGWARNING)
+                    self.metrics.count('prepare_errors')
+                    continue
+                if ( prepared is None ):
+                    self.log('skipping changed image: %s' % repr(source_url))
+                    self.metrics.count('stale_warm_images')
+                    continue
+                image_url, image_size, caption = prepared
+                self.idle.clear()
+                self.preload_image(image_url, source_url, image_size, caption)
+                self.idle.set()
+                self.adapt_depth()
+
+        for source_url, future in self.pending:
+            future.cancel()
+        # Workers waiting for a render process are let go first
+        self.stop_render_pool()
+        self.executor.shutdown(wait=True)
+        self.save_warm_start()
+        self.metadata_cache.save()
+        self.derivative_cache.save()
+
+
+    def load_warm_start(self):
+        if not self.warm_start:
+            return
+        data = load_pickle(WARM_START_FILE, WARM_START_VERSION)
+        if ( data is None or data['signature'] != screensaver.get_playlist_signature() ):
+            return
+        self.warm_images.extend(data['images'])
+        self.log('warm start with %d images' % len(self.warm_images))
+
+
+    def save_warm_start(self):
+        # The images which would have been shown next, in order, with the
+        # size and mtime they have been prepared with
+        if not self.warm_start:
+            return
+        source_urls = self.prefetch_buffer.source_urls()
+        source_urls += [ source_url for source_url, future in self.pending ]
+        source_urls += [ image_url for image_url, expected in self.warm_images ]
+        images = []
+        for source_url in source_urls:
+            entry = self.metadata_cache.entries.get(source_url)
+            images.append((source_url, entry[:2] if entry is not None else None))
+        data = {
+            'signature': screensaver.get_playlist_signature(),
+            'images': images,
+        }
+        if not save_pickle(WARM_START_FILE, WARM_START_VERSION, data):
+            self.log('error saving warm start to %s' % repr(WARM_START_FILE))
+
+
+    def timed_prepare_image(self, image_url, expected=None):
+        start = time.time()
+        prepared = self.prepare_image(image_url, expected)
+        self.prepare_times.append(time.time() - start)
+        self.metrics.record('prepare', self.prepare_times[-1])
+        return prepared
+
+
+    def adapt_depth(self):
+        # The buffer has to cover the images shown while a slow image is
+        # prepared, on top of the reserve the slideshow keeps. The timing
+        # is not representative while a view is (re)built.
+        if ( not self.adaptive or screensaver.recycle or len(self.prepare_times) < PREPARE_TIME_SAMPLES / 4 ):
+            return
+        times = sorted(self.prepare_times)
+        slow_time = times[int(len(times) * 0.9)] * 1000
+        interval = max(float(screensaver.NEXT_IMAGE_TIME), 1.0)
+        minimum, maximum = screensaver.get_prefetch_range()
+        depth = PREFETCH_RESERVE + 1 + int(math.ceil(slow_time / interval))
+        depth = min(maximum, max(minimum, depth))
+        if ( depth != self.prefetch_buffer.capacity ):
+            self.log('prefetch depth: %d (90th percentile preparation %dms, interval %dms)' % (
+                depth, slow_time, interval
+            ), xbmc.LOGINFO)
+            self.metrics.count('prefetch_depth_changes')
+            self.prefetch_buffer.set_capacity(depth)
+
+
+    def has_room(self):
+        return (
+            len(self.pending) < self.workers
+            and self.prefetch_buffer.has_room(len(self.pending))
+        )
 
 
-    def preload_image(self, image_url):
-        # set the next image to an unvisible image-control for caching
-        self.log('caching image: %s' % repr(image_url))
-        image_url = self.rotate_image(image_url)
-        screensaver.preload_controls[image_url] = ControlImage(-1, -1, 1, 1, image_url, False)
-        screensaver.preload_controls[image_url].setVisible(False)
-        screensaver.xbmc_window.addControl(screensaver.preload_controls[image_url])
-        self.log('caching done')
+    def set_paused(self, paused):
+        if paused:
+            self.pause.set()
+        else:
+            self.pause.clear()
+        self.notify()
 
 
-    def rotate_image(self, image_url):
+    def halt(self):
+        self.stop.set()
+        self.playlist.close()
+        self.notify()
 
-        source = SOURCES[int(addon.getSetting('source'))]
 
-        # Do it only for real paths
-        if ( source == 'image_folder' ):
+    def notify(self):
+        self.prefetch_buffer.notify()
 
-            ROTATED = False
-            
-            image=Image.open(open(image_url, 'rb'))
-        
+
+    def preload_image(self, image_url, source_url=None, image_size=None, caption=None):
+        # set the prepared image to an unvisible image-control for caching
+        self.log('caching image: %s' % repr(image_url))
+        with self.metrics.timer('control'):
+            control = screensaver.preload_pool.acquire(image_url)
+        self.prefetch_buffer.put(image_url, control, source_url, image_size, caption)
+
+
+    def render(self, image_url, filepath, rotation, scaled_size):
+        # The file is read through xbmcvfs here, network paths can not be
+        # opened directly and the render processes must not call into Kodi.
+        # The PIL work runs in a separate process if possible, so it does
+        # not compete with Kodi for the GIL
+        data = read_image_file(image_url)
+        render_pool = self.render_pool
+        if render_pool is not None:
             try:
-                exif=dict(list(image._getexif().items()))
-            except AttributeError:
-                exif=[]
-       
-            try:            
-                for orientation in list(ExifTags.TAGS.keys()):
-                    if ExifTags.TAGS[orientation]=='Orientation':
-                        break
-                if exif[orientation] == 3:
-                    image=image.rotate(180, expand=True)
-                    ROTATED = True
-                elif exif[orientation] == 6:
-                    image=image.rotate(270, expand=True)
-                    ROTATED = True
-                elif exif[orientation] == 8:
-                    image=image.rotate(90, expand=True)
-                    ROTATED = True
-            except ( IndexError, KeyError ):
-                pass
+                return render_pool.submit(
+                    render_derivative, data, filepath, rotation, scaled_size
+                ).result(timeout=RENDER_TIMEOUT)
+            except (BrokenProcessPool, CancelledError, FutureTimeoutError, OSError, RuntimeError) as error:
+                if self.stop.is_set():
+                    raise
+                # A forked process may hang on a lock it inherited
+                self.log('render process failed (%r), rendering in threads' % error, xbmc.LOGWARNING)
+                self.metrics.count('render_process_failures')
+                self.stop_render_pool()
+        render_derivative(data, filepath, rotation, scaled_size)
+
+
+    def stop_render_pool(self):
+        # Shuts the render processes down without waiting for them, the
+        # images still queued are rendered by the workers themselves
+        render_pool, self.render_pool = self.render_pool, None
+        if render_pool is None:
+            return
+        try:
+            render_pool.shutdown(wait=False, cancel_futures=True)
+        except TypeError:
+            # Python < 3.9 can not cancel the queued images
+            render_pool.shutdown(wait=False)
+        # A hanging process would keep the interpreter from exiting. The
+        # render pool is the only one starting processes in the addon.
+        for process in multiprocessing.active_children():
+            process.terminate()
 
-            if ( ROTATED is True ):
-                self.log('rotating image: %s' % repr(image_url))
-                filepath = path.join(xbmcvfs.translatePath("special://temp/"), path.split(image_url)[1])
-                image.save(filepath)
-                self.rotated_pictures.append(filepath)
-                self.images[:] = [ x if x != image_url else filepath for x in self.images ]
-                image_url = filepath
 
-            image.close()
-   
-            try:            
-                for datetimeoriginal in list(ExifTags.TAGS.keys()):
-                    if ExifTags.TAGS[datetimeoriginal]=='DateTimeOriginal':
-                        break
-                screensaver.image_dates[image_url] = exif[datetimeoriginal]
-            except ( IndexError, KeyError ):
-                screensaver.image_dates[image_url] = ''
+    def prepare_image(self, image_url, expected=None):
+        # Returns the url to show, the (width, height) it is shown with and
+        # its caption, if known, None if the file does not have the
+        # expected (size, mtime) any more
 
-            return image_url
-            
-        else:
-            return image_url
-   
+        source_url = image_url
+        date = None
+        image_size = None
 
-    def delete_rotated_image(self, image_url):
+        # Do it only for real paths
+        if ( self.prepare_paths and not image_url.startswith('image://') ):
+
+            # The image is only opened if it really needs to be rotated or
+            # scaled down and no such copy is in the cache yet
+            with self.metrics.timer('metadata'):
+                size, mtime, orientation, date, width, height = self.metadata_cache.get(image_url)
+            if ( expected is not None and (size, mtime) != tuple(expected) ):
+                return None
+            rotation = ORIENTATION_ROTATIONS.get(orientation)
+            scaled_size = self.get_scaled_size(width, height, rotation)
+            if ( width and height ):
+                image_size = (height, width) if rotation in (90, 270) else (width, height)
+
+            if ( rotation is not None or scaled_size is not None ):
+                variant = 'rotate%d' % (rotation or 0)
+                if ( scaled_size is not None ):
+                    # A changed screen resolution must not reuse the copies
+                    variant += '|%dx%d|%dx%d' % (scaled_size + screensaver.screen_resolution)
+                key = self.derivative_cache.key(image_url, size, mtime, variant)
+                filepath = self.derivative_cache.get(key, image_url)
+                if ( filepath is None ):
+                    self.log('deriving image: %s (%s)' % (repr(image_url), variant))
+                    filepath = self.derivative_cache.filepath(key, image_url)
+                    try:
+                        with self.metrics.timer('derivative'):
+                            self.render(image_url, filepath, rotation, scaled_size)
+                        self.derivative_cache.add(key, filepath)
+                    except Exception as error:
+                        # Better unrotated or big than not at all
+                        self.log('error deriving image %s: %r' % (repr(image_url), error), xbmc.LOGWARNING)
+                        self.metrics.count('derivative_errors')
+                        filepath = image_url
+                image_url = filepath
 
-        if ( image_url in self.rotated_pictures ):
-            self.log('deleting image: %s' % repr(image_url))
-            try:
-                remove(image_url)
-                self.log('image %s deleted' % repr(image_url))
-            except OSError:
-                self.log('error deleting image %s' % repr(image_url))
+        # Derivatives have hashed names, the caption is made of the original
+        return image_url, image_size, screensaver.prepare_caption(source_url, date)
+
+
+    def get_scaled_size(self, width, height, rotation):
+        # Returns the size (in source orientation) covering the derivative
+        # size or None if the image is not bigger than that anyway
+        if ( self.derivative_size is None or not width or not height ):
+            return None
+        display_width, display_height = width, height
+        if ( rotation in (90, 270) ):
+            display_width, display_height = height, width
+        scale = max(
+            float(self.derivative_size[0]) / display_width,
+            float(self.derivative_size[1]) / display_height
+        )
+        if ( scale >= 1.0 ):
+            return None
+        return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
 
 
-    def log(self, msg):
-        xbmc.log('%s: Cache: %s' % (ADDON_NAME, msg))
+    def log(self, msg, level=xbmc.LOGDEBUG):
+        log_message('Cache: %s' % msg, level)
 
 
 class ScreensaverBase(object):
@@ -218,25 +1825,35 @@ class ScreensaverBase(object):
         # Variables
         self.exit_requested = False
         self.background_control = None
-        self.dialog = None
+        self.feeder = None
+        self.cacher = None
+        self.playlist = None
         self.recycle = False
         self.total_images = 0
         self.image_count = 0
-        self.image_dates = {}
+        self.caption_renderer = None
+        self.image_caption = None
+        self.image_aspect_ratio = 16.0 / 9.0
+        self.folder_index = None
+        self.library_cache = LibraryCache()
+        self.start_time = time.time()
+        self.metrics = Metrics(METRICS_FILE if addon.getSetting('metrics') == 'true' else None)
+        self.cadence = Cadence(self.metrics)
 
         # Controls
         self.image_controls = []
         self.global_controls = []
         self.border_controls = []
-        self.black_label_controls = []
-        self.white_label_controls = []
+        self.caption_controls = []
         self.top_image_controls = []
         self.custom_controls = {}
-        self.preload_controls = {}
+        self.prefetch_buffer = PrefetchBuffer(self.FAST_IMAGE_COUNT)
+        self.timeline = AnimationTimeline()
 
         # Init
-        self.exit_monitor = ExitMonitor(self.stop)
+        self.exit_monitor = ExitMonitor(self.stop, self.library_cache.invalidate)
         self.xbmc_window = ScreensaverWindow(self.stop)
+        self.preload_pool = PreloadControlPool(self.xbmc_window)
         self.xbmc_window.show()
         self.init_global_controls()
         self.load_settings()
@@ -250,6 +1867,19 @@ class ScreensaverBase(object):
         self.screen_width = Window().getWidth()
         self.screen_height = Window().getHeight()
 
+        # The skin coordinates are not necessarily screen pixels
+        try:
+            self.screen_resolution = (
+                int(xbmc.getInfoLabel('System.ScreenWidth')),
+                int(xbmc.getInfoLabel('System.ScreenHeight'))
+            )
+        except ValueError:
+            self.screen_resolution = (self.screen_width, self.screen_height)
+        self.pixel_scale = max(
+            float(self.screen_resolution[0]) / self.screen_width,
+            float(self.screen_resolution[1]) / self.screen_height
+        )
+
         self.log('init_global_controls start')
         loading_img = xbmcvfs.validatePath('/'.join((
             ADDON_PATH, 'resources', 'media', 'loading.gif'
@@ -285,43 +1915,45 @@ class ScreensaverBase(object):
     def start_loop(self):
         self.log('start_loop start')
 
-        # Get images from source
-        images = self.get_images()
-
-        # Shuffle images if requested
-        if addon.getSetting('random_order') == 'true':
-            random.shuffle(images)
-
-        # Start the cacher with images
-        self.cacher = Cache(images)
+        # Discover the images in the background, the playlist is filled
+        # while the first images are already shown
+        self.playlist = Playlist(
+            addon.getSetting('random_order') == 'true',
+            dict(self.get_sources()),
+            int(addon.getSetting('no_repeat_window') or 0),
+            self.load_playlist_state()
+        )
+        self.feeder = ImageFeeder(self.iter_images(), self.playlist, self.metrics)
+        self.feeder.start()
+
+        self.metrics.add_gauge('mode', lambda: self.MODE)
+        self.metrics.add_gauge('screen_resolution', lambda: self.screen_resolution)
+        self.metrics.add_gauge('images_found', lambda: len(self.playlist))
+        self.metrics.add_gauge('images_shown', lambda: self.image_count)
+        self.metrics.add_gauge('prefetch_buffer', self.prefetch_buffer.stats)
+        self.metrics.add_gauge('cadence', self.cadence.stats)
+        self.metrics.add_gauge('preload_controls', self.preload_pool.stats)
+        self.metrics.add_gauge('controls', lambda: {
+            'image': len(self.image_controls),
+            'top_image': len(self.top_image_controls),
+            'border': len(self.border_controls),
+            'rectangles': self.RECTANGLES,
+        })
+
+        # Start the cacher with the playlist
+        self.prefetch_buffer.set_capacity(self.FAST_IMAGE_COUNT)
+        self.cacher = Cache(self.playlist, self.prefetch_buffer)
         self.cacher.start()
 
-        # Define controls for the cycling and get first values
-        image_url_cycle = cycle(images)
+        # Define controls for the cycling
         image_controls_cycle = cycle(self.image_controls)
 
-        image_url = next(image_url_cycle)
-        image_control = next(image_controls_cycle)
-
-        # Preload in case of first initating
-        self.log('initial caching started')
-        self.dialog.create('Caching images...', '' )
-        while len(self.preload_controls) < self.FAST_IMAGE_COUNT:
-            #time.sleep(10)
-            time.sleep(0.01)
-            self.dialog.update(int(100 * len(self.preload_controls) / self.FAST_IMAGE_COUNT), '    ')
-        self.dialog.close()
-
-        # Fade in the background
+        # Fade in the background while the first image is cached
         self.show_background()
 
         # Do it for repetitive views only
         if ( self.VIEW == 1 ):
     
-            # Let the cacher settle down
-            self.cacher.pause.set()
-            self.cacher.idle.wait()
-
             # Set the timing to fast values
             save_EFFECT_SPEED = self.EFFECT_SPEED
             save_NEXT_IMAGE_TIME = self.NEXT_IMAGE_TIME
@@ -329,26 +1961,23 @@ class ScreensaverBase(object):
             self.NEXT_IMAGE_TIME = 10
             self.recycle = True
     
-            # Now load the images in
-            for image_url, control in list(self.preload_controls.items()):
+            # Now load the images in as soon as they are cached
+            for i in range(self.FAST_IMAGE_COUNT):
 
                # Wait
                self.wait()
 
-               if not self.exit_requested:
-                   image_control = next(image_controls_cycle)
-                   self.log('loading image: %s' % repr(image_url))
-                   self.process_image(image_control, image_url)
-                   self.image_count += 1
-                   # Tidy up and move on
-                   try:
-                       self.cacher.delete_rotated_image(image_url)
-                       self.xbmc_window.removeControl(self.preload_controls[image_url])
-                       del self.preload_controls[image_url]
-                   except KeyError:
-                       pass
-    
-            self.cacher.pause.clear()
+               image_control = next(image_controls_cycle)
+               image_url, preload_control, image_size, caption = self.take_preloaded(
+                   aspect_ratio=self.get_slot_aspect_ratio(image_control)
+               )
+               if image_url is None:
+                   break
+
+               self.log('loading image: %s' % repr(image_url))
+               self.show_image(image_control, image_url, image_size, caption)
+               # Tidy up and move on
+               self.discard_preloaded(preload_control, image_control)
                
             # Reset the timing
             self.recycle = False
@@ -358,14 +1987,12 @@ class ScreensaverBase(object):
         # Do the loop
         while not self.exit_requested:
 
-            # Wait
-            self.wait()
+            # Wait, but show the very first image as soon as it is ready
+            if self.image_count:
+                self.wait()
 
-            self.log('Count preload_controls ' + str(len(self.preload_controls)))
-            self.log('Count image_controls ' + str(len(self.image_controls)))
-            self.log('Count top_image_controls ' + str(len(self.top_image_controls)))
-            self.log('Count border_controls ' + str(len(self.border_controls)))
-            self.log('Count RECTANGLES ' + str(self.RECTANGLES))
+            if self.metrics.dump_due():
+                self.metrics.dump()
 
             # Do it for a repetitively changing view
             if ( self.VIEW == 1 ):
@@ -390,18 +2017,12 @@ class ScreensaverBase(object):
                     for image_control in self.image_controls:
                         self.process_image(image_control, self.BORDER_COLOR)
                         image_control = next(image_controls_cycle)
-                        # Tidy up and move on
-                        try:
-                            self.cacher.delete_rotated_image(image_url)
-                            self.xbmc_window.removeControl(self.preload_controls[image_url])
-                            del self.preload_controls[image_url]
-                        except KeyError:
-                            pass
+                    if not self.timeline.finish():
+                        break
 
                     # Remove extra controls if present
                     self.xbmc_window.removeControls(self.border_controls)
-                    self.xbmc_window.removeControls(self.black_label_controls)
-                    self.xbmc_window.removeControls(self.white_label_controls)
+                    self.xbmc_window.removeControls(self.caption_controls)
                     self.xbmc_window.removeControls(self.top_image_controls)
                     
                     # Do the actual redraw of the rectangle view
@@ -409,11 +2030,9 @@ class ScreensaverBase(object):
 
                     # Now load the images in. But first ensure that we have
                     # enough images in the cache
-                    while len(self.preload_controls) < self.FAST_IMAGE_COUNT:
-                        time.sleep(0.05)
-                    else:
-                        # Prevent the cacher from distrubing the animations
-                        self.cacher.pause.set()
+                    self.prefetch_buffer.wait_for(self.FAST_IMAGE_COUNT)
+                    # Prevent the cacher from distrubing the animations
+                    self.cacher.set_paused(True)
 
                     # Wait for the cacher to settle down
                     self.cacher.idle.wait()
@@ -422,196 +2041,313 @@ class ScreensaverBase(object):
                     cache_counter = 1
                     while cache_counter <= self.FAST_IMAGE_COUNT:
 
-                        # Get the image_url and the image_control
-                        for image_url, control in list(self.preload_controls.items()):
-                            break
+                        # Get the image_control and the image_url fitting it
                         image_control = next(image_controls_cycle)
+                        image_url, preload_control, image_size, caption = self.take_preloaded(
+                            aspect_ratio=self.get_slot_aspect_ratio(image_control)
+                        )
+                        if image_url is None:
+                            break
                         self.log('loading image: %s' % repr(image_url))
-                        self.process_image(image_control, image_url)
-                        self.image_count += 1
+                        self.show_image(image_control, image_url, image_size, caption)
                         cache_counter += 1
 
                         # Tidy up and move on
-                        #try:
-                        self.cacher.delete_rotated_image(image_url)
-                        self.xbmc_window.removeControl(self.preload_controls[image_url])
-                        del self.preload_controls[image_url]
-                        #except KeyError:
-                        #    pass
+                        self.discard_preloaded(preload_control, image_control)
 
                     # Let the cache do its work again
-                    self.cacher.pause.clear()
+                    self.cacher.set_paused(False)
 
                     # Reset the timing
                     self.recycle = False
                     self.EFFECT_SPEED = save_EFFECT_SPEED
                     self.NEXT_IMAGE_TIME = save_NEXT_IMAGE_TIME
                     
-                # Fill up cache
-                while len(self.preload_controls) <= 2:
-                    time.sleep(0.05)
-
-                # Get the image_url and the image_control
-                for image_url, control in list(self.preload_controls.items()):
+            # Fill up cache, for the first image one is enough
+            image_control = next(image_controls_cycle)
+            image_url, preload_control, image_size, caption = self.take_preloaded(
+                reserve=PREFETCH_RESERVE if self.image_count else 0,
+                aspect_ratio=self.get_slot_aspect_ratio(image_control)
+            )
+            if image_url is None:
+                break
+
+            if ( self.CONTINUOUS is False ):
+                # Disable caching
+                self.cacher.set_paused(True)
+                # Let the cacher settle down
+                self.cacher.idle.wait()
+            # Do the animation
+            self.log('using image: %s' % repr(image_url))
+            self.show_image(image_control, image_url, image_size, caption)
+
+            # Tidy up and move on
+            self.discard_preloaded(preload_control, image_control)
+
+            if ( self.CONTINUOUS is False ):
+                # Enable caching
+                self.cacher.set_paused(False)
+
+
+    def take_preloaded(self, reserve=0, aspect_ratio=None):
+        # Wait until more than reserve images are cached and return the
+        # oldest (image_url, preload_control, image_size, caption), or the
+        # one fitting aspect_ratio best. (None, None, None, None) on exit.
+        with self.metrics.timer('prefetch_wait'):
+            # Keep the animations going while the images are prepared
+            while ( self.timeline.pending() and not self.timeline.closed ):
+                if self.prefetch_buffer.wait_for(reserve + 1, self.timeline.time_to_next()):
                     break
+                self.timeline.run_due()
+            return self.prefetch_buffer.take(reserve, aspect_ratio) or (None, None, None, None)
 
-                image_control = next(image_controls_cycle)
-   
-                if ( self.CONTINUOUS is False ):
-                    # Disable caching
-                    self.cacher.pause.set()
-                    # Let the cacher settle down
-                    self.cacher.idle.wait()
-                # Do the animation
-                self.log('using image: %s' % repr(image_url))
-                self.process_image(image_control, image_url)
-
-                # Tidy up and move on
-                #try:
-                self.cacher.delete_rotated_image(image_url)
-                self.xbmc_window.removeControl(self.preload_controls[image_url])
-                del self.preload_controls[image_url]
-                #except KeyError:
-                #    pass
-
-                if ( self.CONTINUOUS is False ):
-                    # Enable caching
-                    self.cacher.pause.clear()
-                self.image_count += 1
-
-            # Do the normal work
-            else:
 
-                # Fill up cache
-                while len(self.preload_controls) <= 2:
-                    #xbmc.sleep(50)
-                    time.sleep(0.05)
+    def get_slot_aspect_ratio(self, image_control):
+        # Aspect ratio of the image control the next image is shown in, if
+        # the mode crops images to their controls, may be overwritten in
+        # sub class
+        return None
 
-                # Get the image_url from the cache
-                for image_url, control in list(self.preload_controls.items()):
-                    break
 
-                image_control = next(image_controls_cycle)
+    def discard_preloaded(self, preload_control, image_control):
+        # The preload control keeps the texture loaded until the image
+        # control has taken it over, which may be in a later step of the
+        # animation
+        self.timeline.after(image_control.getId(), lambda: self.preload_pool.release(preload_control))
 
-                if ( self.CONTINUOUS is False ):
-                    # Disable caching
-                    self.cacher.pause.set()
-                    # Let the cacher settle down
-                    self.cacher.idle.wait()
-                # Do the animation
-                self.log('using image: %s' % repr(image_url))
-                self.process_image(image_control, image_url)
 
-                # Tidy up and move on
-                try:
-                    self.cacher.delete_rotated_image(image_url)
-                    self.xbmc_window.removeControl(self.preload_controls[image_url])
-                    del self.preload_controls[image_url]
-                except KeyError:
-                    pass
+    def show_image(self, image_control, image_url, image_size=None, caption=None):
+        # The modes size their controls by image_aspect_ratio, 16:9 like
+        # the fanart of the library if the size of the image is unknown
+        if ( image_size is not None ):
+            self.image_aspect_ratio = float(image_size[0]) / image_size[1]
+        else:
+            self.image_aspect_ratio = 16.0 / 9.0
+        self.image_caption = caption
+        if ( self.image_count == 0 ):
+            self.log('time to first image: %.3fs' % (time.time() - self.start_time), xbmc.LOGINFO)
+            self.metrics.record('first_image', time.time() - self.start_time)
+        self.cadence.changed(self.NEXT_IMAGE_TIME / 1000.0)
+        with self.metrics.timer('process_image'):
+            self.process_image(image_control, image_url)
+        self.image_caption = None
+        self.image_count += 1
+
+
+    def get_playlist_signature(self):
+        # A saved playlist state only applies to the same images
+        return (
+            self.get_sources(),
+            addon.getSetting('prop'),
+            addon.getSetting('image_path'),
+            addon.getSetting('image_path2'),
+            addon.getSetting('image_path3'),
+            addon.getSetting('recursive'),
+            addon.getSetting('random_order'),
+        )
 
-                if ( self.CONTINUOUS is False ):
-                    # Enable caching
-                    self.cacher.pause.clear()
-                self.image_count += 1
 
+    def load_playlist_state(self):
+        if ( addon.getSetting('resume_playlist') != 'true' ):
+            return None
+        data = load_pickle(PLAYLIST_STATE_FILE, PLAYLIST_STATE_VERSION)
+        if ( data is None or data['signature'] != self.get_playlist_signature() ):
+            self.log('no playlist state to continue')
+            return None
+        return data['state']
 
-    def get_images(self):
 
-        self.image_aspect_ratio = 16.0 / 9.0
-        source = SOURCES[int(addon.getSetting('source'))]
-        prop = PROPS[int(addon.getSetting('prop'))]
-        self.dialog = DialogProgress()
-        images = []
-        if source == 'movies':
-            images = self._get_json_images('VideoLibrary.GetMovies', 'movies', prop)
-        elif source == 'albums':
-            images = self._get_json_images('AudioLibrary.GetAlbums', 'albums', prop)
-        elif source == 'shows':
-            images = self._get_json_images('VideoLibrary.GetTVShows', 'tvshows', prop)
-        elif source == 'image_folder':
-            path = addon.getSetting('image_path')
-            self.log(path)
-            if path:
-                self.dialog.create('Getting images recursively')
-                images = self._get_folder_images(path)
-                self.dialog.close()
-        if not images:
+    def save_playlist_state(self):
+        if ( self.playlist is None or addon.getSetting('resume_playlist') != 'true' ):
+            return
+        data = {
+            'signature': self.get_playlist_signature(),
+            'state': self.playlist.state(),
+        }
+        if not save_pickle(PLAYLIST_STATE_FILE, PLAYLIST_STATE_VERSION, data):
+            self.log('error saving playlist state to %s' % repr(PLAYLIST_STATE_FILE))
+
+
+    def get_sources(self):
+        # [(source, weight)] of the sources to show images from
+        if ( addon.getSetting('multiple_sources') == 'true' ):
+            sources = [
+                (source, int(addon.getSetting('weight_%s' % source) or 0))
+                for source in SOURCES
+            ]
+            sources = [ (source, weight) for source, weight in sources if weight > 0 ]
+            if sources:
+                return sources
+        return [ (SOURCES[int(addon.getSetting('source'))], 1) ]
+
+
+    def iter_images(self):
+        # Generator for (source, images) batches, runs in the ImageFeeder
+        # thread
+        sources = [ source for source, weight in self.get_sources() ]
+        if ( len(sources) == 1 ):
+            batches = (
+                (sources[0], batch) for batch in self._iter_source_images(sources[0])
+            )
+        else:
+            batches = self._iter_concurrent_images(sources)
+        found = False
+        for source, batch in batches:
+            if batch:
+                found = True
+                yield source, batch
+        if not found:
             cmd = 'XBMC.Notification("{header}", "{message}")'.format(
                 header=addon.getLocalizedString(32500),
                 message=addon.getLocalizedString(32501)
             )
             xbmc.executebuiltin(cmd)
-            images = (
-                self._get_json_images('VideoLibrary.GetMovies', 'movies', 'fanart')
-                or self._get_json_images('AudioLibrary.GetArtists', 'artists', 'fanart')
-            )
-        return images
+            for method, key in (('VideoLibrary.GetMovies', 'movies'), ('AudioLibrary.GetArtists', 'artists')):
+                for batch in self._iter_json_images(method, key, 'fanart'):
+                    if batch:
+                        found = True
+                        yield None, batch
+                if found:
+                    break
+
+
+    def _iter_source_images(self, source):
+        # Generator for the batches of images of one source
+        prop = PROPS[int(addon.getSetting('prop'))]
+        if source == 'movies':
+            return self._iter_json_images('VideoLibrary.GetMovies', 'movies', prop)
+        elif source == 'albums':
+            return self._iter_json_images('AudioLibrary.GetAlbums', 'albums', prop)
+        elif source == 'shows':
+            return self._iter_json_images('VideoLibrary.GetTVShows', 'tvshows', prop)
+        elif source == 'image_folder':
+            paths = []
+            for setting_id in ('image_path', 'image_path2', 'image_path3'):
+                path = addon.getSetting(setting_id)
+                if path and path not in paths:
+                    paths.append(path)
+            self.log(paths)
+            if paths:
+                return self._iter_folder_images(paths)
+        return iter(())
+
+
+    def _iter_concurrent_images(self, sources):
+        # Walks all sources at the same time, every one in its own thread,
+        # and yields their (source, images) batches as they arrive
+        batches = queue.Queue()
+        stop = threading.Event()
+
+        def walk(source):
+            try:
+                for batch in self._iter_source_images(source):
+                    if stop.is_set():
+                        break
+                    batches.put((source, batch))
+            except Exception as error:
+                self.log('error reading source %s: %r' % (source, error), xbmc.LOGWARNING)
+            finally:
+                batches.put((source, None))
+
+        for source in sources:
+            thread = threading.Thread(target=walk, args=(source,))
+            thread.daemon = True
+            thread.start()
+        remaining = len(sources)
+        try:
+            while remaining:
+                source, batch = batches.get()
+                if ( batch is None ):
+                    remaining -= 1
+                    continue
+                yield source, batch
+        finally:
+            stop.set()
+
+
+    def _iter_json_images(self, method, key, prop):
+        # Generator for the images of a library in pages of
+        # LIBRARY_PAGE_SIZE items, served from the library cache if the
+        # library has not changed
+        self.log('_iter_json_images start: %s' % method)
+        self.library_cache.load()
+        images, total = self._get_json_page(method, key, prop, 0, 1)
+        if ( total is None ):
+            return
+        cached = self.library_cache.get(method, prop, total)
+        if ( cached is not None ):
+            self.metrics.count('library_cache_hits')
+            self.log('_iter_json_images end: %d images from cache' % len(cached))
+            yield cached
+            return
+
+        self.metrics.count('library_cache_misses')
+        images = []
+        start = 0
+        while ( start < total ):
+            page, total = self._get_json_page(method, key, prop, start, start + LIBRARY_PAGE_SIZE)
+            if ( total is None ):
+                # Failed request, do not cache an incomplete list
+                return
+            start += LIBRARY_PAGE_SIZE
+            images.extend(page)
+            yield page
+
+        # Only reached if the feeder has not been stopped meanwhile
+        self.library_cache.put(method, prop, total, images)
+        self.library_cache.save()
+        self.log('_iter_json_images end: %d of %d items with images' % (len(images), total))
 
 
-    def _get_json_images(self, method, key, prop):
-        self.log('_get_json_images start')
+    def _get_json_page(self, method, key, prop, start, end):
+        # Returns the images of the items start to end and the item count
+        # of the library, which is None on errors
         query = {
             'jsonrpc': '2.0',
             'id': 0,
             'method': method,
             'params': {
                 'properties': [prop],
+                'limits': {'start': start, 'end': end},
             }
         }
-        response = json.loads(xbmc.executeJSONRPC(json.dumps(query)))
+        with self.metrics.timer('json_rpc'):
+            response = json.loads(xbmc.executeJSONRPC(json.dumps(query)))
+        result = response.get('result')
+        if ( result is None ):
+            self.log('%s failed: %r' % (method, response.get('error')), xbmc.LOGWARNING)
+            return [], None
         images = [
             element[prop] for element
-            in response.get('result', {}).get(key, [])
+            in result.get(key, [])
             if element.get(prop)
         ]
+        return images, result.get('limits', {}).get('total', 0)
 
-        self.log('_get_json_images end')
-        return images
-
-
-    def _get_folder_dirs(self, dirs, path):
-
-        directories, files = xbmcvfs.listdir(path)
-
-        for directory in directories:
-            dirs.append(xbmcvfs.validatePath('/'.join((path, directory, ''))))
-
-        if addon.getSetting('recursive') == 'true':
-            for directory in directories:
-                if directory.startswith('.'):
-                    continue
-                for sub_directory in self._get_folder_dirs([], xbmcvfs.validatePath('/'.join((path, directory, '')))):
-                    dirs.append(xbmcvfs.validatePath(sub_directory))
-        
-        return dirs
-
-
-    def _get_folder_images(self, path):
 
-        self.log('_get_folder_images started')
-        def _dive_into_dir(path):
+    def _iter_folder_images(self, paths):
 
-            directories, files = xbmcvfs.listdir(path)
-
-            images = [
-                xbmcvfs.validatePath(path + f) for f in files
-                if f.lower()[-3:] in ('jpg', 'png', 'bmp')
-            ]
-
-            return images
-
-        dirs = self._get_folder_dirs([], path)
-        dir_count = 1
+        self.log('_iter_folder_images started')
+        if addon.getSetting('folder_index') == 'true':
+            self.folder_index = FolderIndex()
+            self.folder_index.load()
+        scanner = FolderScanner(
+            recursive=addon.getSetting('recursive') == 'true',
+            folder_index=self.folder_index,
+            workers=int(addon.getSetting('scan_workers') or 1),
+            metrics=self.metrics
+        )
 
-        images = []
-        for directory in dirs:
-            progress_update = int(100 * dir_count / len(dirs))
-            self.dialog.update(progress_update, directory)
-            dir_count = dir_count + 1
-            images.extend(_dive_into_dir(directory))
+        for directory, directory_images in scanner.walk(paths):
+            yield directory_images
 
-        return images
+        # Only a complete walk may be saved, the index drops every
+        # directory which has not been visited
+        if self.folder_index is not None:
+            self.folder_index.save()
+        self.metrics.count('directories', scanner.dir_count)
+        self.metrics.count('listdir_calls', scanner.listdir_count)
+        self.log('_iter_folder_images end: %d directories, %d listdir calls' % (scanner.dir_count, scanner.listdir_count))
 
 
     def show_background(self):
@@ -625,59 +2361,98 @@ class ScreensaverBase(object):
         self.background_control.setImage(bg_img)
 
 
+    def get_prefetch_range(self):
+        # (minimum, maximum) number of prefetched images. A redraw of the
+        # random rectangles view takes FAST_IMAGE_COUNT images at once.
+        minimum = PREFETCH_RESERVE + 1
+        if ( self.VIEW == 1 ):
+            minimum = max(minimum, self.FAST_IMAGE_COUNT)
+        return minimum, max(minimum, 2 * self.FAST_IMAGE_COUNT)
+
+
+    def get_max_image_size(self):
+        # Largest (width, height) in skin coordinates an image control of
+        # this mode gets, may be overwritten in sub class
+        return self.screen_width, self.screen_height
+
+
+    def get_derivative_size(self):
+        width, height = self.get_max_image_size()
+        return int(width * self.pixel_scale), int(height * self.pixel_scale)
+
+
+    def prepare_caption(self, source_url, date):
+        # Called by the workers of the cacher, so modes with a
+        # caption_renderer get it rendered before the image is shown.
+        # Returns the caption show_image gets along with the image.
+        if ( self.caption_renderer is None ):
+            return None
+        return self.caption_renderer.get(get_caption_text(source_url, date))
+
+
     def process_image(self, image_control, image_url):
         # Needs to be implemented in sub class
         raise NotImplementedError
 
 
     def wait(self):
-        # wait in chunks of 500ms to react earlier on exit request
-        chunk_wait_time = int(CHUNK_WAIT_TIME)
-        remaining_wait_time = int(self.NEXT_IMAGE_TIME)
-        while remaining_wait_time > 0:
-            if self.exit_requested:
-                self.cacher.stop.set()
-                return
-            if remaining_wait_time < chunk_wait_time:
-                chunk_wait_time = remaining_wait_time
-            remaining_wait_time -= chunk_wait_time
-            #time.sleep(float(chunk_wait_time) / 1000)
-            xbmc.sleep(chunk_wait_time)
+        # Wait for the deadline of the next image change. The animations go
+        # on meanwhile, an exit request ends the wait at once.
+        deadline = self.cadence.next_deadline(self.NEXT_IMAGE_TIME / 1000.0)
+        if not self.timeline.run_until(deadline):
+            self.cacher.halt()
 
 
     def stop(self):
         self.log('stop')
         self.exit_requested = True
         self.exit_monitor = None
+        self.timeline.close()
+        if self.feeder is not None:
+            self.feeder.stop.set()
+        if self.cacher is not None:
+            self.cacher.halt()
+        self.prefetch_buffer.close()
 
 
     def close(self):
+        # Let the cacher write its caches before the controls are gone
+        if self.cacher is not None:
+            self.cacher.halt()
+            self.cacher.join()
+        self.save_playlist_state()
+        if self.caption_renderer is not None:
+            self.caption_renderer.save()
+        self.log('prefetch buffer: %s' % self.prefetch_buffer.stats(), xbmc.LOGINFO)
+        self.log('preload controls: %s' % self.preload_pool.stats(), xbmc.LOGINFO)
+        self.log('%s cadence: %s' % (self.MODE, self.cadence.stats()), xbmc.LOGINFO)
+        if self.metrics.dump():
+            self.log('metrics written to %s' % repr(METRICS_FILE), xbmc.LOGINFO)
         self.del_controls()
 
 
     def del_controls(self):
         self.log('del_controls start')
+        self.timeline.clear()
         self.xbmc_window.removeControls(self.image_controls)
         self.xbmc_window.removeControls(self.global_controls)
-        #self.xbmc_window.removeControls(self.preload_controls)
+        self.prefetch_buffer.clear()
+        self.xbmc_window.removeControls(self.preload_pool.clear())
         self.xbmc_window.removeControls(self.top_image_controls)
-        self.xbmc_window.removeControls(self.black_label_controls)
-        self.xbmc_window.removeControls(self.white_label_controls)
-        self.preload_controls = {}
+        self.xbmc_window.removeControls(self.caption_controls)
         self.custom_controls = {}
         self.background_control = None
-        self.image_dates = []
+        self.image_caption = None
         self.image_controls = []
         self.global_controls = []
-        self.black_label_controls = []
-        self.white_label_controls = []
+        self.caption_controls = []
         self.top_image_controls = []
         self.xbmc_window.close()
         self.xbmc_window = None
         self.log('del_controls end')
 
-    def log(self, msg):
-        xbmc.log('%s: %s' % (ADDON_NAME, msg))
+    def log(self, msg, level=xbmc.LOGDEBUG):
+        log_message(msg, level)
 
 
 class TableDropScreensaver(ScreensaverBase):
@@ -693,6 +2468,9 @@ class TableDropScreensaver(ScreensaverBase):
     def load_settings(self):
         self.NEXT_IMAGE_TIME = int(addon.getSetting('tabledrop_wait'))
 
+    def get_max_image_size(self):
+        return self.MAX_WIDTH, self.MAX_WIDTH
+
     def process_image(self, image_control, image_url):
         ROTATE_ANIMATION = (
             'effect=rotate start=0 end=%d center=auto time=%d '
@@ -712,9 +2490,17 @@ class TableDropScreensaver(ScreensaverBase):
         # re-stack it (to be on top)
         self.xbmc_window.removeControl(image_control)
         self.xbmc_window.addControl(image_control)
-        # calculate all parameters and properties
-        width = random.randint(self.MIN_WIDTH, self.MAX_WIDTH)
-        height = int(width / self.image_aspect_ratio)
+        # calculate all parameters and properties, the longer side of the
+        # image gets the random size
+        size = random.randint(self.MIN_WIDTH, self.MAX_WIDTH)
+        if ( self.image_aspect_ratio >= 1.0 ):
+            width = size
+            height = int(size / self.image_aspect_ratio)
+        else:
+            width = int(size * self.image_aspect_ratio)
+            height = size
+        width = max(1, min(width, self.screen_width))
+        height = max(1, min(height, self.screen_height))
         x_position = random.randint(0, self.screen_width - width)
         y_position = random.randint(0, self.screen_height - height)
         drop_height = random.randint(400, 800)
@@ -734,10 +2520,8 @@ class TableDropScreensaver(ScreensaverBase):
         image_control.setWidth(width)
         image_control.setHeight(height)
         image_control.setAnimations(animations)
-        # show the image
+        # show the image, it drops while the next one is waited for
         image_control.setVisible(True)
-        #xbmc.sleep(int(drop_duration))
-        time.sleep(float(drop_duration) / 1000)
 
 
 class StarWarsScreensaver(ScreensaverBase):
@@ -846,6 +2630,11 @@ class AppleTVLikeScreensaver(ScreensaverBase):
         self.MAX_TIME = int(15000 / self.SPEED)
         self.NEXT_IMAGE_TIME = int(4500.0 / self.CONCURRENCY / self.SPEED)
 
+    def get_max_image_size(self):
+        # See stack_cycle_controls, zoom is at most 50 percent
+        width = int(self.screen_width / 2)
+        return width, width
+
     def stack_cycle_controls(self):
         # randomly generate a zoom in percent as betavariant
         # between 10 and 70 and assign calculated width to control.
@@ -920,6 +2709,12 @@ class GridSwitchScreensaver(ScreensaverBase):
         self.RECTANGLES = self.ROWS_AND_COLUMNS * self.ROWS_AND_COLUMNS
         self.FAST_IMAGE_COUNT = self.IMAGE_CONTROL_COUNT
 
+    def get_max_image_size(self):
+        return (
+            int(self.screen_width / self.ROWS_AND_COLUMNS),
+            int(self.screen_height / self.ROWS_AND_COLUMNS)
+        )
+
     def stack_cycle_controls(self):
         # Set position and dimensions based on stack position.
         # Shuffle image list to have random order.
@@ -937,6 +2732,20 @@ class GridSwitchScreensaver(ScreensaverBase):
             random.shuffle(self.image_controls)
 
     def process_image(self, image_control, image_url):
+        # A control only fades out when its previous fade in is done
+        key = image_control.getId()
+        self.timeline.finish(key)
+
+        def fade_in():
+            image_control.setImage(image_url)
+            FADE_IN_ANIMATION = (
+                'effect=fade start=0 end=100 time=%d condition=true' % self.EFFECT_TIME
+            )
+            animations = [
+                ('conditional', FADE_IN_ANIMATION),
+            ]
+            image_control.setAnimations(animations)
+
         if not self.image_count < self.FAST_IMAGE_COUNT:
             FADE_OUT_ANIMATION = (
                 'effect=fade start=100 end=0 time=%d condition=true' % self.EFFECT_TIME
@@ -945,16 +2754,9 @@ class GridSwitchScreensaver(ScreensaverBase):
                 ('conditional', FADE_OUT_ANIMATION),
             ]
             image_control.setAnimations(animations)
-            #xbmc.sleep(self.EFFECT_TIME)
-            time.sleep(float(self.EFFECT_TIME) / 1000)
-        image_control.setImage(image_url)
-        FADE_IN_ANIMATION = (
-            'effect=fade start=0 end=100 time=%d condition=true' % self.EFFECT_TIME
-        )
-        animations = [
-            ('conditional', FADE_IN_ANIMATION),
-        ]
-        image_control.setAnimations(animations)
+            self.timeline.schedule(self.EFFECT_TIME, fade_in, key)
+        else:
+            fade_in()
 
 
 class SlidingPanelsScreensaver(ScreensaverBase):
@@ -986,6 +2788,8 @@ class SlidingPanelsScreensaver(ScreensaverBase):
         self.RANDOM_ORDER = addon.getSetting('slidingpanels_random') == 'true'
         self.DESCRIPTION = addon.getSetting('slidingpanels_description') == 'true'
         self.DESCRIPTION_POSITION = int(addon.getSetting('slidingpanels_description_position'))
+        if self.DESCRIPTION:
+            self.caption_renderer = CaptionRenderer(self.pixel_scale)
         self.BORDER = addon.getSetting('slidingpanels_border') == 'true'
         self.BORDER_WIDTH = int(addon.getSetting('slidingpanels_border_width'))
         self.BORDER_COLOR = int(addon.getSetting('slidingpanels_border_color'))
@@ -1027,6 +2831,16 @@ class SlidingPanelsScreensaver(ScreensaverBase):
             self.BACKGROUND_IMAGE="white.jpg"
 
 
+    def get_max_image_size(self):
+        # Random rectangles may get as big as the screen
+        if ( self.VIEW == 0 ):
+            return (
+                int(self.screen_width / self.ROWS_AND_COLUMNS),
+                int(self.screen_height / self.ROWS_AND_COLUMNS)
+            )
+        return self.screen_width, self.screen_height
+
+
     def stack_cycle_controls(self):
         # Set position and dimensions based on stack position.
         # Shuffle image list to have random order.
@@ -1034,62 +2848,6 @@ class SlidingPanelsScreensaver(ScreensaverBase):
         if ( self.recycle is False ):
             super(SlidingPanelsScreensaver, self).stack_cycle_controls()
 
-        class Rectangle:
-        
-            def __init__(self,x, y, w, h):
-                self.x = x
-                self.y = y
-                self.h = h
-                self.w = w
-                self.position = (self.x,self.y)
-                self.area = h * w
-        
-        
-            def random_divide(self, orientation=None):
-       
-                if ( self.w < self.h ):
-                    orientation = self.h
-                elif ( self.w > self.h ):
-                    orientation = self.w
-                else:
-                    orientation = self.w
-
-                division = random.choice([ 2, 3, 4 ])
-                first_image_smaller = random.choice([ True, False ])
-        
-                new = int( orientation / division )
-        
-                if ( orientation == self.w ):
-                    if ( first_image_smaller is True ):
-                        return [ Rectangle(self.x, self.y, new, self.h), Rectangle(self.x + new, self.y, self.w - new, self.h) ]
-                    else:
-                        return [ Rectangle(self.x, self.y, self.w - new, self.h), Rectangle(self.x + (self.w - new ), self.y, new, self.h) ]
-                else:
-                    if ( first_image_smaller is True ):
-                        return [ Rectangle(self.x, self.y, self.w, new), Rectangle(self.x, self.y + new, self.w, self.h - new) ]
-                    else:
-                        return [ Rectangle(self.x, self.y, self.w, self.h - new), Rectangle(self.x, self.y + ( self.h - new ), self.w, new) ]
-        
-        
-        def make_rects(w, h, number):
-        
-            rectangles = [ Rectangle(0, 0, w, h) ]
-            w_threshold = w / 4
-            h_threshold = h / 4
-        
-            # Choose the rectangle with the highest area
-            rectangles.sort(key=lambda x: x.area, reverse=True)
-        
-            while ( len(rectangles) < number ):
-
-                rectangles.sort(key=lambda x: x.area, reverse=True)
-                rectangle = rectangles[0]
-                rectangles = rectangles + rectangle.random_divide()
-                rectangles.remove(rectangle)
-
-            return rectangles
-
-
         if ( self.BORDER is True ):
             border = self.BORDER_WIDTH
         else:
@@ -1099,7 +2857,7 @@ class SlidingPanelsScreensaver(ScreensaverBase):
 
         # Create random retangles
         if ( self.VIEW == 1 ):
-            random_rectangles = make_rects(self.screen_width, self.screen_height, self.RECTANGLES)
+            random_rectangles = make_rectangles(self.screen_width, self.screen_height, self.RECTANGLES)
 
         # Cycle through image controls and set dimensions and position
         for i, image_control in enumerate(self.image_controls):
@@ -1185,6 +2943,7 @@ class SlidingPanelsScreensaver(ScreensaverBase):
             image_control.setVisible(False)
 
             custom_controls = {}
+            custom_controls['aspect_ratio'] = float(width) / max(1, height)
 
             # Set the dimension of the image control being on top (to hide sliding panels)
             custom_controls['top_image_control'] = ControlImage(x_position, y_position, width, height, '', aspectRatio=1)
@@ -1200,28 +2959,18 @@ class SlidingPanelsScreensaver(ScreensaverBase):
 
             custom_controls['border_controls'] = border_controls
            
-            # Set the labels
-            black_label_controls = {}
-            white_label_controls = {}
-
+            # Set the caption
             if ( self.DESCRIPTION is True ):
                 # Unfortunately, KODI does not support outlined fonts, which are nice to have on bright pictures.
-                # Hence, we create four underlying imagecontrols with black color and one on top with white color
+                # Hence, the captions are rendered into images with an outline and shown in this box
                 if (self.DESCRIPTION_Y == 'top'):
                     description_x = x_position + 10
                     description_y = y_position + 10
                 elif (self.DESCRIPTION_Y == 'bottom'):
                     description_x = x_position + 10
                     description_y = y_position + height - 40
-                black_label_controls['b_left'] = ControlLabel(description_x - 1, description_y, width - 20, 30, '', textColor='0xFF000000', alignment=self.DESCRIPTION_X)
-                black_label_controls['b_right'] = ControlLabel(description_x + 1, description_y, width - 20, 30, '', textColor='0xFF000000', alignment=self.DESCRIPTION_X)
-                black_label_controls['b_top'] = ControlLabel(description_x, description_y + 1, width - 20, 30, '', textColor='0xFF000000', alignment=self.DESCRIPTION_X)
-                black_label_controls['b_bottom'] = ControlLabel(description_x, description_y - 1, width - 20, 30, '', textColor='0xFF000000', alignment=self.DESCRIPTION_X)
-                white_label_controls['w_center'] = ControlLabel(description_x, description_y, width - 20, 30, '', textColor='0xFFFFFFFF', alignment=self.DESCRIPTION_X)
-
-            # Add label controls to custom controls
-            custom_controls['black_label_controls'] = black_label_controls
-            custom_controls['white_label_controls'] = white_label_controls
+                custom_controls['caption_box'] = (description_x, description_y, width - 20, 30)
+                custom_controls['caption_control'] = ControlImage(description_x, description_y, width - 20, 30, '')
 
             # Add all controls to the dict with the ID of the image_control as key
             self.custom_controls[image_control.getId()] = custom_controls
@@ -1229,21 +2978,17 @@ class SlidingPanelsScreensaver(ScreensaverBase):
         # Activate the custom controls in the appropriate order:
         # All custom controls are on top of the image_controls
         # Highest up are the borders
-        # Below are the labels
-        # Below the labes are the top images
+        # Below are the captions
+        # Below the captions are the top images
         self.border_controls = [ i for l in [ [ l_ctrl for l, l_ctrl in l_lists ] for l_lists in [ list(ctrls['border_controls'].items()) for k, ctrls in list(self.custom_controls.items()) ] ] for i in l ]
-        self.black_label_controls = [ i for l in [ [ l_ctrl for l, l_ctrl in l_lists ] for l_lists in [ list(ctrls['black_label_controls'].items()) for k, ctrls in list(self.custom_controls.items()) ] ] for i in l ]
-        self.white_label_controls = [ i for l in [ [ l_ctrl for l, l_ctrl in l_lists ] for l_lists in [ list(ctrls['white_label_controls'].items()) for k, ctrls in list(self.custom_controls.items()) ] ] for i in l ]
+        self.caption_controls = [ ctrls['caption_control'] for k, ctrls in list(self.custom_controls.items()) if 'caption_control' in ctrls ]
         self.top_image_controls = [ ctrls['top_image_control'] for k, ctrls in list(self.custom_controls.items()) ]
 
         # Add top image controls
         self.xbmc_window.addControls(self.top_image_controls)
 
-        # Add black labels
-        self.xbmc_window.addControls(self.black_label_controls)
-
-        # Add white labels
-        self.xbmc_window.addControls(self.white_label_controls)
+        # Add captions
+        self.xbmc_window.addControls(self.caption_controls)
 
         # Add borders
         self.xbmc_window.addControls(self.border_controls)
@@ -1254,17 +2999,21 @@ class SlidingPanelsScreensaver(ScreensaverBase):
 
     def process_image(self, image_control, image_url):
 
+        # A panel only slides again when its previous slide is done
+        key = image_control.getId()
+        if not self.timeline.finish(key):
+            return
+
         # Get random slide in variables
         horizontal_in = bool(random.getrandbits(1))
         leftup_in = bool(random.getrandbits(1))
         leftup_out = bool(random.getrandbits(1))
 
         # Get the control labels
-        custom_controls = self.custom_controls[image_control.getId()]
+        custom_controls = self.custom_controls[key]
         top_image_control = custom_controls['top_image_control']
         border_controls = custom_controls['border_controls']
-        black_label_controls = [ label_controls for key, label_controls in list(custom_controls['black_label_controls'].items()) ]
-        white_label_controls = [ label_controls for key, label_controls in list(custom_controls['white_label_controls'].items()) ]
+        caption_control = custom_controls.get('caption_control')
 
         # If the status of visibility is False, we entered the image_control the first time
         if ( image_control.isVisible() ):
@@ -1272,7 +3021,7 @@ class SlidingPanelsScreensaver(ScreensaverBase):
         else:
             initiating = True
             image_control.setVisible(True)
-            for key, border_control in list(border_controls.items()):
+            for border_control in list(border_controls.values()):
                 border_control.setImage(self.BORDER_COLOR)
 
             # Set the timing to fast values
@@ -1282,10 +3031,12 @@ class SlidingPanelsScreensaver(ScreensaverBase):
             self.NEXT_IMAGE_TIME = 10
             self.recycle = True
 
-        # Remove the control labels ( image gets replaced)
-        if ( self.DESCRIPTION is True ) or ( self.recycle is True ):
-            for label_control in black_label_controls + white_label_controls:
-                label_control.setVisible(False)
+        # The later steps run on the timeline, they need the timing of now
+        recycle = self.recycle
+
+        # Remove the caption ( image gets replaced)
+        if ( caption_control is not None ):
+            caption_control.setVisible(False)
 
         # Remove the top image (we would like to see the sliding animation)
         top_image_control.setVisible(False)
@@ -1326,7 +3077,7 @@ class SlidingPanelsScreensaver(ScreensaverBase):
                 time_in = int(float(height) / self.EFFECT_SPEED )
             else:
                 time_in = 500
-            if ( self.recycle is False ):
+            if ( recycle is False ):
                 time_out = int(float(width) / self.EFFECT_SPEED )
             else:
                 time_out = 10
@@ -1335,7 +3086,7 @@ class SlidingPanelsScreensaver(ScreensaverBase):
                 time_in = int(float(width) / self.EFFECT_SPEED )
             else:
                 time_in = 500
-            if ( self.recycle is False ):
+            if ( recycle is False ):
                 time_out = int(float(height) / self.EFFECT_SPEED )
             else:
                 time_out = 10
@@ -1350,106 +3101,83 @@ class SlidingPanelsScreensaver(ScreensaverBase):
         ]
         image_control.setAnimations(animations)
 
-        if self.recycle is False:
-            #xbmc.sleep(time_out + 10)
-            time.sleep( float(time_out + 10) / 1000)
-
-        # Prepare for slide in
-        image_control.setImage(image_url)
-        top_image_control.setImage(image_url)
-        # Adapt image name
-        if ( self.DESCRIPTION is True ):
-            if ( image_url != self.BORDER_COLOR ):
-                #image_name = image_url.split('/')[-1].split('.')[0].replace('_', ' ')
-                #image_name = ''.join([i for i in image_name if not i.isdigit()])
-                image_name = path.splitext(path.split(image_url)[1])[0]
-                image_name = re.sub('_(\s)?[0-9]*$', '', image_name)
-                image_name = re.sub('^[0-9]*(\s)?_', '', image_name)
-                image_name = re.sub('-(\s)?[0-9]*$', '', image_name)
-                image_name = re.sub('^[0-9]*(\s)?-', '', image_name)
-                image_name = image_name.replace('_', ' ').strip()
-                try:
-                    year = self.image_dates[image_url].split(':')[0]
-                except KeyError:
-                    year = ''
-                if ( year != '' ):
-                    image_name = image_name + ' (' + year + ')'
+        # Adapt the caption, it has been rendered with the image
+        caption = self.image_caption
+
+        def slide_in():
+            # Prepare for slide in
+            image_control.setImage(image_url)
+            top_image_control.setImage(image_url)
+            if ( caption_control is not None ) and ( caption is not None ):
+                self.place_caption(caption_control, custom_controls['caption_box'], caption)
+
+            # If we initiate, we would rather zoom the images in
+            if ( initiating is True ):
+                MOVE_ANIMATION = (
+                    'effect=zoom start=10 end=100 time=%s '
+                    'tween=bounce ease=in delay=50 center=auto condition=true'
+                )
+                animations = [
+                    ('conditional', MOVE_ANIMATION % time_in)
+                ]
+                image_control.setAnimations(animations)
+                image_control.setVisible(True)
             else:
-                image_name = ''
-            for label_control in black_label_controls + white_label_controls:
-                label_control.setLabel(image_name)
-
-        # If we initiate, we would rather zoom the images in
-        if ( initiating is True ):
-            MOVE_ANIMATION = (
-                'effect=zoom start=10 end=100 time=%s '
-                'tween=bounce ease=in delay=50 center=auto condition=true'
-            )
-            animations = [
-                ('conditional', MOVE_ANIMATION % time_in)
-            ]
-            image_control.setAnimations(animations)
-            image_control.setVisible(True)
-        else:
-            MOVE_ANIMATION = (
-                'effect=slide start=%s end=0,0 time=%s '
-                'tween=sine ease=out delay=10 condition=true'
-            )
-            animations = [
-                ('conditional', MOVE_ANIMATION % ( start, time_in) )
-            ]
-            image_control.setAnimations(animations)
+                MOVE_ANIMATION = (
+                    'effect=slide start=%s end=0,0 time=%s '
+                    'tween=sine ease=out delay=10 condition=true'
+                )
+                animations = [
+                    ('conditional', MOVE_ANIMATION % ( start, time_in) )
+                ]
+                image_control.setAnimations(animations)
+
+            caption_time = 0
+            if ( self.DESCRIPTION is True ):
+                FADE_ANIMATION = (
+                    'effect=fade start=0 end=100 time=%s '
+                    'tween=sine ease=out delay=10 condition=true'
+                )
+                animations = [
+                    ('conditional', FADE_ANIMATION % time_in )
+                ]
+
+                caption_control.setAnimations(animations)
+
+                # Adjust the time of the appearance of the description based on
+                # position and slide in animation
+                if ( recycle is False ):
+                    # If we slide in from below or from right, delay the fading in
+                    # of the description (looks nicer)
+                    starts = start.split(',')
+
+                    if ( int(starts[0]) >= 0 ) and ( self.DESCRIPTION_X == 0 ):
+                        caption_time = time_in
+                    elif ( int(starts[0]) < 0 ) and ( self.DESCRIPTION_X == 1 ):
+                        caption_time = time_in
+                    elif ( self.DESCRIPTION_X == 2 ):
+                        caption_time = int( time_in / 2 )
+
+                    if ( int(starts[1]) >= 0 ) and ( self.DESCRIPTION_Y == 'top' ):
+                        caption_time = time_in
+                    elif ( int(starts[1]) < 0 ) and ( self.DESCRIPTION_Y == 'bottom' ):
+                        caption_time = time_in
+
+                if ( caption is not None ):
+                    self.timeline.schedule(caption_time, lambda: caption_control.setVisible(True), key)
+
+            if ( recycle is False ):
+                self.timeline.schedule(caption_time + time_in + 10, show_top_image, key)
+            else:
+                self.timeline.schedule(time_in, show_top_image, key)
 
-        if ( self.DESCRIPTION is True ):
-            FADE_ANIMATION = (
-                'effect=fade start=0 end=100 time=%s '
-                'tween=sine ease=out delay=10 condition=true'
-            )
-            animations = [
-                ('conditional', FADE_ANIMATION % time_in )
-            ]
+        def show_top_image():
+            top_image_control.setVisible(True)
 
-            for label_control in black_label_controls + white_label_controls:
-                label_control.setAnimations(animations)
-
-            # Adjust the time of the appearance of the description based on
-            # position and slide in animation
-            if ( self.recycle is False ):
-                # If we slide in from below or from right, delay the fading in
-                # of the description (looks nicer)
-                sleep_time = 0
-                starts = start.split(',')
-
-                if ( int(starts[0]) >= 0 ) and ( self.DESCRIPTION_X == 0 ):
-                    sleep_time = time_in
-                elif ( int(starts[0]) < 0 ) and ( self.DESCRIPTION_X == 1 ):
-                    sleep_time = time_in
-                elif ( self.DESCRIPTION_X == 2 ):
-                    sleep_time = int( time_in / 2 )
-
-                if ( int(starts[1]) >= 0 ) and ( self.DESCRIPTION_Y == 'top' ):
-                    sleep_time = time_in
-                elif ( int(starts[1]) < 0 ) and ( self.DESCRIPTION_Y == 'bottom' ):
-                    sleep_time = time_in
-                #xbmc.sleep(sleep_time)
-                time.sleep(float(sleep_time) / 1000)
-
-            for label_control in black_label_controls + white_label_controls:
-                label_control.setVisible(True)
-
-        if self.recycle is False:
-            #xbmc.sleep(time_in + 10)
-            time.sleep( float(time_in + 10) / 1000 )
+        if ( recycle is False ):
+            self.timeline.schedule(time_out + 10, slide_in, key)
         else:
-            #xbmc.sleep(time_in)
-            time.sleep(float(time_in) / 1000 )
-
-        top_image_control.setVisible(True)
-
-        try:
-            del self.image_dates[image_url]
-        except KeyError:
-           pass
+            slide_in()
 
         if ( initiating is True ):
 
@@ -1459,6 +3187,351 @@ class SlidingPanelsScreensaver(ScreensaverBase):
             self.NEXT_IMAGE_TIME = save_NEXT_IMAGE_TIME
 
 
+    def get_slot_aspect_ratio(self, image_control):
+        # The panels crop the images, so they get the ones fitting best
+        return self.custom_controls[image_control.getId()]['aspect_ratio']
+
+
+    def place_caption(self, caption_control, caption_box, caption):
+        # Fits the caption image into the caption box of the panel, aligned
+        # like a label would be. Captions wider than the box are scaled down.
+        filepath, width, height = caption
+        box_x, box_y, box_width, box_height = caption_box
+        scale = min(1.0, float(box_width) / width, float(box_height) / height)
+        width = int(width * scale)
+        height = int(height * scale)
+        if ( self.DESCRIPTION_X == 1 ):
+            x_position = box_x + box_width - width
+        elif ( self.DESCRIPTION_X == 2 ):
+            x_position = box_x + int((box_width - width) / 2)
+        else:
+            x_position = box_x
+        if ( self.DESCRIPTION_Y == 'bottom' ):
+            y_position = box_y + box_height - height
+        else:
+            y_position = box_y
+        caption_control.setImage(filepath)
+        caption_control.setPosition(x_position, y_position)
+        caption_control.setWidth(max(1, width))
+        caption_control.setHeight(max(1, height))
+
+
+class LayoutRectangle(object):
+
+    # A panel of the random rectangles view of SlidingPanels
+
+    __slots__ = ('x', 'y', 'w', 'h', 'area')
+
+    def __init__(self, x, y, w, h):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.area = w * h
+
+
+    def random_divide(self):
+        # Splits the longer side at a half, third or quarter
+        division = random.choice([ 2, 3, 4 ])
+        first_image_smaller = random.choice([ True, False ])
+
+        if ( self.w >= self.h ):
+            new = int( self.w / division )
+            if ( first_image_smaller is False ):
+                new = self.w - new
+            return LayoutRectangle(self.x, self.y, new, self.h), LayoutRectangle(self.x + new, self.y, self.w - new, self.h)
+        else:
+            new = int( self.h / division )
+            if ( first_image_smaller is False ):
+                new = self.h - new
+            return LayoutRectangle(self.x, self.y, self.w, new), LayoutRectangle(self.x, self.y + new, self.w, self.h - new)
+
+
+def make_rectangles(width, height, number):
+    # Divides the screen into number rectangles by splitting the biggest
+    # one again and again. The heap is ordered by area, the counter keeps
+    # equal areas in the order they have been made.
+    rectangles = [ (-width * height, 0, LayoutRectangle(0, 0, width, height)) ]
+    counter = 1
+    while ( len(rectangles) < number ):
+        rectangle = heapq.heappop(rectangles)[2]
+        for part in rectangle.random_divide():
+            heapq.heappush(rectangles, (-part.area, counter, part))
+            counter += 1
+    return [ rectangle for area, counter, rectangle in sorted(rectangles) ]
+
+
+class HeaderReader(object):
+
+    # Reads parts of a file through xbmcvfs (so network paths work too).
+    # Consecutive reads are served from one growing buffer, jumps further
+    # than HEADER_CHUNK_SIZE seek instead of reading the bytes in between.
+
+    def __init__(self, image_file):
+        self.file = image_file
+        self.buffer = b''
+        self.offset = 0
+
+
+    def read(self, position, length):
+        buffer_end = self.offset + len(self.buffer)
+        if ( position < self.offset or position > buffer_end + HEADER_CHUNK_SIZE ):
+            self.file.seek(position, 0)
+            self.offset = position
+            self.buffer = b''
+            buffer_end = position
+        end = position + length
+        if ( end > buffer_end ):
+            self.buffer += bytes(self.file.readBytes(max(end - buffer_end, HEADER_CHUNK_SIZE)))
+        start = position - self.offset
+        data = self.buffer[start:start + length]
+        if ( len(data) < length ):
+            raise ValueError('unexpected end of file')
+        return data
+
+
+def read_image_header(image_url):
+    # Returns (orientation, date, width, height) of a JPEG, PNG or BMP image
+    # by parsing its headers only. Raises ValueError for anything else.
+    image_file = xbmcvfs.File(image_url)
+    try:
+        reader = HeaderReader(image_file)
+        signature = reader.read(0, 8)
+        if ( signature[:2] == b'\xff\xd8' ):
+            return parse_jpeg_header(reader)
+        elif ( signature == b'\x89PNG\r\n\x1a\n' ):
+            width, height = struct.unpack('>II', reader.read(16, 8))
+            return None, '', width, height
+        elif ( signature[:2] == b'BM' ):
+            if ( struct.unpack('<I', reader.read(14, 4))[0] == 12 ):
+                width, height = struct.unpack('<HH', reader.read(18, 4))
+            else:
+                width, height = struct.unpack('<ii', reader.read(18, 8))
+            # Top-down bitmaps have a negative height
+            return None, '', abs(width), abs(height)
+    finally:
+        image_file.close()
+    raise ValueError('unknown image format')
+
+
+def parse_jpeg_header(reader):
+    # Walks the JPEG markers up to the frame header, the Exif segment
+    # (if any) comes before it
+    orientation = None
+    date = ''
+    position = 2
+    while True:
+        marker, code = reader.read(position, 2)
+        if ( marker != 0xFF ):
+            raise ValueError('invalid JPEG marker at %d' % position)
+        if ( code == 0xFF ):
+            # Fill byte
+            position += 1
+            continue
+        if ( code == 0x01 or 0xD0 <= code <= 0xD8 ):
+            # Markers without a segment
+            position += 2
+            continue
+        if ( code in (0xD9, 0xDA) ):
+            raise ValueError('no JPEG frame header')
+        length = struct.unpack('>H', reader.read(position + 2, 2))[0]
+        if ( code == 0xE1 and orientation is None and not date ):
+            orientation, date = parse_exif(reader, position + 4)
+        elif ( 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC) ):
+            height, width = struct.unpack('>HH', reader.read(position + 5, 4))
+            return orientation, date, width, height
+        position += 2 + length
+
+
+def parse_exif(reader, start):
+    # Returns (orientation, date) from the APP1 segment starting at start
+    orientation = None
+    date = ''
+    if ( reader.read(start, 6) != b'Exif\x00\x00' ):
+        return orientation, date
+    tiff = start + 6
+    byte_order = reader.read(tiff, 2)
+    if ( byte_order == b'II' ):
+        endian = '<'
+    elif ( byte_order == b'MM' ):
+        endian = '>'
+    else:
+        return orientation, date
+    exif_ifd = None
+    ifd_offset = struct.unpack(endian + 'I', reader.read(tiff + 4, 4))[0]
+    for tag, value_type, count, value in read_ifd(reader, tiff, ifd_offset, endian):
+        if ( tag == EXIF_ORIENTATION ):
+            orientation = struct.unpack(endian + 'H', value[:2])[0]
+        elif ( tag == EXIF_IFD_POINTER ):
+            exif_ifd = struct.unpack(endian + 'I', value)[0]
+    if ( exif_ifd is not None ):
+        for tag, value_type, count, value in read_ifd(reader, tiff, exif_ifd, endian):
+            if ( tag == EXIF_DATETIMEORIGINAL and value_type == 2 ):
+                if ( count > 4 ):
+                    value = reader.read(tiff + struct.unpack(endian + 'I', value)[0], count)
+                date = value[:count].split(b'\x00')[0].decode('ascii', 'ignore')
+    return orientation, date
+
+
+def read_ifd(reader, tiff, offset, endian):
+    # Yields (tag, type, count, raw 4 byte value) of every IFD entry
+    count = struct.unpack(endian + 'H', reader.read(tiff + offset, 2))[0]
+    entries = reader.read(tiff + offset + 2, 12 * count)
+    for i in range(count):
+        entry = entries[12 * i:12 * i + 12]
+        tag, value_type, value_count = struct.unpack(endian + 'HHI', entry[:8])
+        yield tag, value_type, value_count, entry[8:]
+
+
+def read_image_metadata(image_url):
+    # Returns (orientation, date, width, height) read by PIL, for images
+    # read_image_header can not handle
+    with BytesIO(read_image_file(image_url)) as image_file:
+        image = Image.open(image_file)
+        width, height = image.size
+        try:
+            exif = image._getexif() or {}
+        except AttributeError:
+            exif = {}
+        image.close()
+    return exif.get(EXIF_ORIENTATION), exif.get(EXIF_DATETIMEORIGINAL) or '', width, height
+
+
+def create_render_pool(workers):
+    # Returns a process pool for render_derivative or None if processes are
+    # not available. Only forked processes work, a spawned one would need to
+    # import the Kodi modules.
+    try:
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork')
+        )
+    except (ValueError, OSError, NotImplementedError):
+        return None
+
+
+def read_image_file(image_url):
+    # Returns the content of a local or network file
+    image_file = xbmcvfs.File(image_url)
+    try:
+        data = bytes(image_file.readBytes())
+    finally:
+        image_file.close()
+    if not data:
+        raise IOError('can not read %s' % repr(image_url))
+    return data
+
+
+def render_derivative(data, filepath, rotation, scaled_size):
+    # Writes the rotated and/or scaled down copy of the image data to
+    # filepath. Several workers may render the same image, so every one
+    # writes its own temporary file and the last one wins.
+    temp_file = '%s.%d.%d.tmp' % (filepath, os.getpid(), threading.get_ident())
+    image_format = IMAGE_FORMATS.get(path.splitext(filepath)[1], 'JPEG')
+    try:
+        with BytesIO(data) as image_file:
+            image = Image.open(image_file)
+            if ( scaled_size is not None ):
+                # Let the JPEG decoder do most of the downscaling (1/2 to 1/8)
+                image.draft('RGB', scaled_size)
+                image = image.resize(scaled_size, Image.BILINEAR)
+            if ( rotation is not None ):
+                image = image.rotate(rotation, expand=True)
+            if ( image_format == 'JPEG' ):
+                image.convert('RGB').save(temp_file, image_format, quality=90)
+            else:
+                image.save(temp_file, image_format)
+            image.close()
+        replace(temp_file, filepath)
+    finally:
+        # Nothing is left behind if rendering or replacing failed
+        if path.exists(temp_file):
+            try:
+                remove(temp_file)
+            except OSError:
+                pass
+
+
+def load_caption_font(size):
+    try:
+        return ImageFont.truetype(CAPTION_FONT, size)
+    except OSError:
+        log_message('caption font %s not found, using the default one' % repr(CAPTION_FONT), xbmc.LOGWARNING)
+        try:
+            return ImageFont.load_default(size)
+        except TypeError:
+            # Pillow < 10.1 has a bitmap font of a fixed size only
+            return ImageFont.load_default()
+
+
+def render_caption(text, filepath, font):
+    # Writes the text in white with a black outline on a transparent
+    # background to filepath and returns the size of the image. The height
+    # only depends on the font, so captions line up.
+    left, top, right, bottom = font.getbbox(text, stroke_width=CAPTION_OUTLINE)
+    if hasattr(font, 'getmetrics'):
+        bottom = sum(font.getmetrics()) + CAPTION_OUTLINE
+    size = (max(1, right - left), max(1, bottom + CAPTION_OUTLINE))
+    image = Image.new('RGBA', size, (0, 0, 0, 0))
+    ImageDraw.Draw(image).text(
+        (-left, CAPTION_OUTLINE), text, font=font, fill=(255, 255, 255, 255),
+        stroke_width=CAPTION_OUTLINE, stroke_fill=(0, 0, 0, 255)
+    )
+    temp_file = '%s.%d.tmp' % (filepath, threading.get_ident())
+    image.save(temp_file, 'PNG')
+    replace(temp_file, filepath)
+    return size
+
+
+def get_caption_text(image_url, date):
+    # The caption of an image is its cleaned up file name and the year it
+    # has been taken
+    image_name = path.splitext(path.split(image_url)[1])[0]
+    image_name = re.sub(r'_(\s)?[0-9]*$', '', image_name)
+    image_name = re.sub(r'^[0-9]*(\s)?_', '', image_name)
+    image_name = re.sub(r'-(\s)?[0-9]*$', '', image_name)
+    image_name = re.sub(r'^[0-9]*(\s)?-', '', image_name)
+    image_name = image_name.replace('_', ' ').strip()
+    year = date.split(':')[0] if date else ''
+    if ( year != '' ):
+        image_name = image_name + ' (' + year + ')'
+    return image_name
+
+
+def load_pickle(pickle_file, version):
+    # Returns the data of a versioned pickle file or None
+    try:
+        with open(pickle_file, 'rb') as f:
+            data = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError, ValueError):
+        return None
+    if ( not isinstance(data, dict) or data.get('version') != version ):
+        return None
+    return data.get('data')
+
+
+def save_pickle(pickle_file, version, data):
+    # Atomically replaces the pickle file, returns False on errors
+    xbmcvfs.mkdirs(path.dirname(pickle_file))
+    temp_file = pickle_file + '.tmp'
+    try:
+        with open(temp_file, 'wb') as f:
+            pickle.dump({'version': version, 'data': data}, f, pickle.HIGHEST_PROTOCOL)
+        replace(temp_file, pickle_file)
+    except (IOError, OSError, pickle.PicklingError):
+        return False
+    return True
+
+
+def log_message(msg, level=xbmc.LOGDEBUG):
+    if ( level > xbmc.LOGDEBUG or DEBUG_LOGGING ):
+        xbmc.log('%s: %s' % (ADDON_NAME, msg), level)
+
+
+def is_image(filename):
+    return filename.lower()[-3:] in IMAGE_EXTENSIONS
+
+
 def cycle(iterable):
     saved = []
     for element in iterable:
@@ -1469,9 +3542,21 @@ def cycle(iterable):
             yield element
 
 
+def rebuild_folder_index():
+    FolderIndex().clear()
+    cmd = 'Notification("{header}", "{message}")'.format(
+        header=ADDON_NAME,
+        message=addon.getLocalizedString(32502)
+    )
+    xbmc.executebuiltin(cmd)
+
+
 if __name__ == '__main__':
-    screensaver = ScreensaverManager()
-    screensaver.start_loop()
-    screensaver.close()
-    del screensaver
-    sys.modules.clear()
+    if ( sys.argv[1:2] == ['rebuild_index'] ):
+        rebuild_folder_index()
+    else:
+        screensaver = ScreensaverManager()
+        screensaver.start_loop()
+        screensaver.close()
+        del screensaver
+        sys.modules.clear()